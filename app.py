@@ -1,7 +1,11 @@
 import streamlit as st
-from data.data_helper import get_data_for_interaction_metrics, get_data_for_survey_frequency_metrics
-from data.plot_helper import run_interaction_plotting_pipeline, run_survey_plotting_pipeline
-from data.helper_functions import adjusted_start_month, adjusted_end_month, add_days_between_column
+from data.data_helper import get_data_for_interaction_metrics, get_data_for_survey_frequency_metrics, \
+    get_data_for_survey_frequency_summary, get_activity_bitmap_for_retention, get_engaged_time_sketches, \
+    get_engaged_time_month_sketches, SURVEY_QUERY_MODE
+from data.pipeline import evaluate_nodes
+from data.helper_functions import ARR_BIN_EDGES
+from data.export import EXPORT_FORMATS, export_table
+import math
 import pandas as pd
 from datetime import datetime, timedelta
 
@@ -17,7 +21,7 @@ st.markdown("""
 Measuring user engagement on our platform is essential for understanding how effectively our product is meeting 
 user needs.
 
-All charts are downloadable! 🤗
+All charts are downloadable, and their data can be exported as CSV, Parquet or Excel! 🤗
 """
             )
 
@@ -28,6 +32,7 @@ with st.expander("Outline", expanded=True):
         - Engaged Time
         - Number of Days Engaged
     - **Number of Active Makers**
+    - **Maker Retention**
     - **Survey Frequencies** 
         - Number of Days Between Purchases
         """
@@ -59,24 +64,114 @@ if st.session_state.end_month < st.session_state.start_month:
     st.session_state.start_month = default_start_month.strftime('%Y-%m')
     st.session_state.end_month = default_end_month
 
+# sidebar for ARR brackets, accounts are re-binned on change (no re-binning of the maker rows)
+st.sidebar.title('ARR brackets')
+arr_edges_input = st.sidebar.text_input('Bracket edges (in k, comma separated)',
+                                        ', '.join(f'{edge / 1000:g}' for edge in ARR_BIN_EDGES))
+try:
+    arr_bin_edges = sorted({float(edge) * 1000 for edge in arr_edges_input.split(',')})
+    # float() also parses 'inf' and 'nan', which pd.cut can't use as edges
+    if not all(math.isfinite(edge) for edge in arr_bin_edges):
+        raise ValueError('Bracket edges must be finite')
+    st.session_state.arr_bin_edges = arr_bin_edges
+except ValueError:
+    st.sidebar.error('Bracket edges must be numbers separated by commas. The default brackets are used.')
+    st.session_state.arr_bin_edges = ARR_BIN_EDGES
+
+
+def export_data(table, file_name, key):
+    """
+    Export the aggregated data of a chart. The data is only serialized once the export is requested, and kept with the
+    table and format it was serialized from, so reruns don't serialize it again. The request is cleared when the file
+    is downloaded or when the table changes, e.g. after a date or account change.
+    """
+    requested_key = f'{key}_requested'
+    export_key = f'{key}_export'
+
+    def on_export_downloaded():
+        st.session_state[requested_key] = False
+        st.session_state[export_key] = None
+
+    # the tables are cached pipeline results, a different object means the chart was recomputed
+    export = st.session_state.get(export_key)
+    if export is not None and export[0] is not table:
+        st.session_state[requested_key] = False
+        st.session_state[export_key] = export = None
+
+    col1, col2 = st.columns([1, 3])
+    export_format = col1.selectbox('Data format', list(EXPORT_FORMATS), key=f'{key}_format',
+                                   label_visibility='collapsed')
+    if col2.button('Export data', key=f'{key}_button'):
+        st.session_state[requested_key] = True
+
+    if st.session_state.get(requested_key, False):
+        if export is None or export[1] != export_format:
+            export = (table, export_format, export_table(table, export_format))
+            st.session_state[export_key] = export
+
+        extension, mime = EXPORT_FORMATS[export_format]
+        st.download_button(
+            label=f"Download data ({export_format})",
+            data=export[2],
+            file_name=f"{file_name}.{extension}",
+            mime=mime,
+            key=f'{key}_download',
+            on_click=on_export_downloaded,
+        )
 
-def main_pipeline():
-    interaction_df = get_data_for_interaction_metrics()
-    interaction_df = interaction_df[(interaction_df['engaged_month'] >= st.session_state.start_month)
-                                    & (interaction_df['engaged_month'] <= st.session_state.end_month)]
-    arr_start_month = adjusted_start_month(st.session_state.start_month)
-    arr_end_month = adjusted_end_month(st.session_state.end_month)
-    arr_interaction_df = interaction_df[(interaction_df['engaged_month'] >= arr_start_month)
-                                        & (interaction_df['engaged_month'] <= arr_end_month)]
 
+# input name of the pipeline nodes -> loader of the cached data
+PIPELINE_INPUTS = {
+    'interaction_data': get_data_for_interaction_metrics,
+    'engaged_time_sketches': get_engaged_time_sketches,
+    'engaged_time_month_sketches': get_engaged_time_month_sketches,
+    'activity_bitmap': get_activity_bitmap_for_retention,
+    'survey_data': get_data_for_survey_frequency_metrics,
+    'survey_summary': get_data_for_survey_frequency_summary,
+}
+
+
+def run_pipeline(names, **params):
+    """
+    Get the results of the given pipeline nodes for the current selection. Only the nodes whose inputs changed since
+    the previous rerun of the session are recomputed.
+    """
+    params = dict(start_month=st.session_state.start_month, end_month=st.session_state.end_month,
+                  arr_bin_edges=st.session_state.arr_bin_edges, **params)
+    if 'pipeline_cache' not in st.session_state:
+        st.session_state.pipeline_cache = {}
+
+    return evaluate_nodes(names, params, PIPELINE_INPUTS, st.session_state.pipeline_cache)
+
+
+def merge_charts(results):
+    """
+    Merge the pngs and tables of the chart nodes into one dictionary.
+    """
+    final_dic = dict()
+    for result in results.values():
+        final_dic.update(result)
+
+    return final_dic
+
+
+def main_pipeline():
     st.header(
         f"""💫 Platform Engagement""")
     st.markdown("""<hr style="height:8px;border:none;color:#333;background-color:#333;" /> """, unsafe_allow_html=True)
 
     st.header("""Engagement Time""")
 
+    engaged_time_statistic = st.radio("Show", ['Average', 'Median & Percentiles'], horizontal=True,
+                                      key='engaged_time_statistic')
+    # the captions and the downloaded file names follow the statistic shown
+    if engaged_time_statistic == 'Median & Percentiles':
+        statistic_caption, file_name_suffix = 'Median & Percentiles of Engagement Time', 'engagement_time_percentiles'
+    else:
+        statistic_caption, file_name_suffix = 'Average Engagement Time', 'engagement_time'
+
     st.write(
-        f"""Plot of *Average Engagement Time* per Maker by Month."""
+        f"""Plot of *{statistic_caption}* per Maker by Month."""
     )
 
     with st.expander("Definition of Engagement"):
@@ -93,7 +188,7 @@ def main_pipeline():
         st.session_state['clear_selection_triggered'] = False
 
     # define the list of options for the selectbox, including a default placeholder
-    options = ['Select an account'] + sorted(interaction_df['account_name'].unique())
+    options = ['Select an account'] + run_pipeline(['account_options'])['account_options']
 
     # define a callback function to update the session state based on selection
     def on_account_selected():
@@ -120,52 +215,61 @@ def main_pipeline():
             # reset the selected account name and trigger a rerun
             st.session_state['selected_account_name'] = 'Select an account'
             st.session_state['clear_selection_triggered'] = True
-            st.experimental_rerun()
+            st.rerun()
 
-    # filter the df based on the selection (if not the placeholder)
+    # filter the charts based on the selection (if not the placeholder)
     if st.session_state['selected_account_name'] and st.session_state['selected_account_name'] != 'Select an account':
-        account_df = interaction_df[interaction_df['account_name'] == st.session_state['selected_account_name']]
+        account_name = st.session_state['selected_account_name']
     else:
-        account_df = interaction_df
+        account_name = None
 
-    # generate and display charts
-    final_dic_engage = run_interaction_plotting_pipeline(interaction_df, arr_interaction_df, account_df)
+    # generate and display charts, the percentiles come from merging the engaged time sketches of the selection, not
+    # from the raw rows
+    if engaged_time_statistic == 'Median & Percentiles':
+        chart_nodes = ['chart1', 'chart2_percentiles', 'chart3_percentiles', 'chart4', 'chart5']
+    else:
+        chart_nodes = ['chart1', 'chart2', 'chart3', 'chart4', 'chart5']
+    results = run_pipeline(chart_nodes + ['arr_is_empty'], account_name=account_name)
+    arr_is_empty = results.pop('arr_is_empty')
+    final_dic_engage = merge_charts(results)
 
-    fig2 = final_dic_engage["fig2"]
     img2 = final_dic_engage["img2"]
 
-    st.pyplot(fig2)
+    st.image(img2)
 
     btn2 = st.download_button(
         label="Download plot of Engagement Time",
         data=img2,
-        file_name=f"fig2_engagement_time.png",
+        file_name=f"fig2_{file_name_suffix}.png",
         mime="image/png",
         key="btn2",
     )
 
+    export_data(final_dic_engage["table2"], f"fig2_{file_name_suffix}", key="export2")
+
     st.markdown("""---""")
 
     st.write(
-        f"""Plot of *Average Engagement Time* by Account ARR."""
+        f"""Plot of *{statistic_caption}* by Account ARR."""
     )
-    if arr_interaction_df.empty:
+    if arr_is_empty:
         st.error('The selected time frame does not contain at least one entire half year period, the ARR plots are done'
                  ' with the default time frame')
 
-    fig3 = final_dic_engage["fig3"]
     img3 = final_dic_engage["img3"]
 
-    st.pyplot(fig3)
+    st.image(img3)
 
     btn3 = st.download_button(
         label="Download Engagement Time by ARR",
         data=img3,
-        file_name=f"fig3_engagement_time_arr.png",
+        file_name=f"fig3_{file_name_suffix}_arr.png",
         mime="image/png",
         key="btn3",
     )
 
+    export_data(final_dic_engage["table3"], f"fig3_{file_name_suffix}_arr", key="export3")
+
     st.markdown("""---""")
 
     st.header("Number of Days Engaged")
@@ -180,14 +284,13 @@ def main_pipeline():
         # button to clear selection here as well
         if st.button('Clear Selection'):
             st.session_state.selected_account_name = ''  # clear the selection
-            st.experimental_rerun()  # rerun the app
+            st.rerun()  # rerun the app
     else:
         st.write("Showing charts for all accounts.")
 
-    fig4 = final_dic_engage["fig4"]
     img4 = final_dic_engage["img4"]
 
-    st.pyplot(fig4)
+    st.image(img4)
 
     btn4 = st.download_button(
         label="Download Days Engaged",
@@ -197,20 +300,21 @@ def main_pipeline():
         key="btn4",
     )
 
+    export_data(final_dic_engage["table4"], "fig4_days_engaged", key="export4")
+
     st.markdown("""---""")
 
     st.write(
         f"""The Average Number of Days Engaged by Account ARR"""
     )
 
-    if arr_interaction_df.empty:
+    if arr_is_empty:
         st.error('The selected time frame does not contain at least one entire half year period, the ARR plots are done'
                  ' with the default time frame')
 
-    fig5 = final_dic_engage["fig5"]
     img5 = final_dic_engage["img5"]
 
-    st.pyplot(fig5)
+    st.image(img5)
 
     btn5 = st.download_button(
         label="Download Days Engaged by ARR",
@@ -220,6 +324,8 @@ def main_pipeline():
         key="btn5",
     )
 
+    export_data(final_dic_engage["table5"], "fig5_days_engaged_arr", key="export5")
+
     st.markdown("""<hr style="height:8px;border:none;color:#333;background-color:#333;" /> """, unsafe_allow_html=True)
 
     st.header("🪩 Number of Active Makers")
@@ -240,10 +346,9 @@ def main_pipeline():
     """)
 
     # Active maker filters
-    fig1 = final_dic_engage["fig1"]
     img1 = final_dic_engage["img1"]
 
-    st.pyplot(fig1)
+    st.image(img1)
 
     btn1 = st.download_button(
         label="Download plot of Active Makers/ Active Results Makers",
@@ -253,36 +358,66 @@ def main_pipeline():
         key="btn1",
     )
 
+    export_data(final_dic_engage["table1"], "fig1_active_makers", key="export1")
+
+    st.markdown("""<hr style="height:8px;border:none;color:#333;background-color:#333;" /> """, unsafe_allow_html=True)
+
+    st.header("🔁 Maker Retention")
+    st.markdown("""<hr style="height:8px;border:none;color:#333;background-color:#333;" /> """, unsafe_allow_html=True)
+
+    st.write(
+        f"""The % of Active Makers from each *first active month* cohort who are still active N months later."""
+    )
+
+    with st.expander("Definition of Cohorts"):
+        st.markdown("""   
+    - A maker's cohort is the first month they were an ***Active Maker*** (since 2022-01-01).
+    - Months since 0 is always 100%, later months show the share of the cohort which was active again in that month.
+    """)
+
+    interaction_bins = run_pipeline(['interaction_bins'])['interaction_bins']
+    retention_arr_bin = st.selectbox("Account ARR", ['All'] + list(interaction_bins.cat.categories),
+                                     key='retention_arr_bin')
+
+    final_dic_retention = merge_charts(run_pipeline(
+        ['chart8'], retention_arr_bin=None if retention_arr_bin == 'All' else retention_arr_bin))
+
+    img8 = final_dic_retention["img8"]
+
+    st.image(img8)
+
+    btn8 = st.download_button(
+        label="Download plot of Maker Retention",
+        data=img8,
+        file_name=f"fig8_maker_retention.png",
+        mime="image/png",
+        key="btn8",
+    )
+
+    export_data(final_dic_retention["table8"], "fig8_maker_retention", key="export8")
+
     st.markdown("""<hr style="height:8px;border:none;color:#333;background-color:#333;" /> """, unsafe_allow_html=True)
 
     st.header(
         f"""🗓️ Survey Frequencies"""
     )
     st.markdown("""<hr style="height:8px;border:none;color:#333;background-color:#333;" /> """, unsafe_allow_html=True)
-    orig_survey_df = get_data_for_survey_frequency_metrics()
-    survey_df = orig_survey_df[(orig_survey_df['purchase_month'] >= st.session_state.start_month)
-                          & (orig_survey_df['purchase_month'] <= st.session_state.end_month)]
-
-    final_dic_survey = run_survey_plotting_pipeline(orig_survey_df, survey_df)
+    if SURVEY_QUERY_MODE == 'summary':
+        final_dic_survey = merge_charts(run_pipeline(['summary_purchasers', 'summary_chart6', 'summary_chart7']))
+    else:
+        final_dic_survey = merge_charts(run_pipeline(['purchasers', 'chart6', 'chart7']))
 
     # Get some numbers of makers
-    df_all = add_days_between_column(orig_survey_df)
-    df_multiple = df_all.drop(df_all[df_all['days_from_previous'].isna()].index)
-
-    single_2022 = len(df_all[df_all['purchase_year'] == '2022'].groupby('maker_id').filter(lambda x: len(x) == 1))
-    single_2023 = len(df_all[df_all['purchase_year'] == '2023'].groupby('maker_id').filter(lambda x: len(x) == 1))
-
-    multiple_2022 = len(df_multiple[df_multiple['purchase_year'] == '2022']['maker_id'].value_counts())
-    multiple_2023 = len(df_multiple[df_multiple['purchase_year'] == '2023']['maker_id'].value_counts())
+    purchasers = final_dic_survey["purchasers"]
 
-    st.write("**Average Days Between Purchases - 2022:**", int(df_multiple[df_multiple['purchase_year'] == '2022']['days_from_previous'].mean().round()), "days")
-    st.write("**Average Days Between Purchases - 2023:**", int(df_multiple[df_multiple['purchase_year'] == '2023']['days_from_previous'].mean().round()), "days")
+    st.write("**Average Days Between Purchases - 2022:**",
+             int(round(purchasers.loc['2022', 'Average Days Between'])), "days")
+    st.write("**Average Days Between Purchases - 2023:**",
+             int(round(purchasers.loc['2023', 'Average Days Between'])), "days")
 
     st.write("**Note:** This metric only includes the makers who have purchased multiple surveys within the year.")
 
-    tbl = pd.DataFrame({'Single Purchasers': [single_2022, single_2023],
-                        'Multiple Purchasers': [multiple_2022, multiple_2023]},
-                       index=['2022', '2023'])
+    tbl = purchasers.loc[['2022', '2023'], ['Single Purchasers', 'Multiple Purchasers']].rename_axis(None)
     tbl['Ratio'] = tbl['Single Purchasers'] / (tbl['Single Purchasers'] + tbl['Multiple Purchasers'])
 
     with st.expander("The ratio between Single Purchasers and Multiple Purchasers", expanded=True):
@@ -290,10 +425,9 @@ def main_pipeline():
 
     st.header("Days Between Purchases")
 
-    fig6 = final_dic_survey["fig6"]
     img6 = final_dic_survey["img6"]
 
-    st.pyplot(fig6)
+    st.image(img6)
 
     btn6 = st.download_button(
         label="Download Days Between by ARR",
@@ -303,15 +437,16 @@ def main_pipeline():
         key="btn6",
     )
 
+    export_data(final_dic_survey["table6"], "fig6_days_between_arr", key="export6")
+
     with st.expander("The percentages of Makers and Accounts across ARR brackets", expanded=False):
         st.write(
             f"""The percentages of Maker and Account across ARR brackets is shown in stacked rows here for reference."""
         )
 
-        fig7 = final_dic_survey["fig7"]
         img7 = final_dic_survey["img7"]
 
-        st.pyplot(fig7)
+        st.image(img7)
 
         btn7 = st.download_button(
             label="Download plot of Maker% and Account% by ARR",
@@ -321,5 +456,7 @@ def main_pipeline():
             key="btn7",
         )
 
+        export_data(final_dic_survey["table7"], "fig7_maker_and_acct_by_arr", key="export7")
+
 
 main_pipeline()
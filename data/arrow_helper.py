@@ -0,0 +1,96 @@
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pandas import DataFrame
+from data.helper_functions import ACCOUNT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+
+def read_sql_arrow(connection, query, transform=None):
+    """
+    Get the query results as an Arrow table. Clients with a read_sql_arrow method stream the results as a
+    pyarrow.RecordBatchReader, the results of the other clients are converted from their pandas df.
+
+    :param connection: the warehouse client.
+    :param query: the SQL query.
+    :param transform: (optional) the function deriving columns from a table of results, applied to each record batch
+    as it arrives.
+    :return: the query results table.
+    """
+    if hasattr(connection, 'read_sql_arrow'):
+        reader = connection.read_sql_arrow(query)
+        schema, batches = reader.schema, reader
+    else:
+        # the pandas object columns are still built by the client, only the derived columns are computed with Arrow
+        logger.info('The warehouse client has no read_sql_arrow, converting its pandas results to Arrow')
+        table = pa.Table.from_pandas(connection.read_sql_query(query), preserve_index=False)
+        schema, batches = table.schema, table.to_batches()
+
+    transform = transform or (lambda table_: table_)
+    tables = [transform(pa.Table.from_batches([batch])) for batch in batches]
+    if not tables:
+        return transform(schema.empty_table())
+    return pa.concat_tables(tables)
+
+
+def get_codes(values: pa.ChunkedArray):
+    """
+    Get the integer code of each value, numbered in the sorted order of the unique values with nulls last, the same as
+    grouping with pandas then ngroup().
+    """
+    unique = pc.unique(values)
+    unique = unique.take(pc.sort_indices(unique))
+    return pc.index_in(values, value_set=unique, skip_nulls=False).cast(pa.int32())
+
+
+def split_account_dimension_arrow(table: pa.Table):
+    """
+    Split the query results into a fact table keyed by integer account and maker codes, and an account dimension table,
+    the same as split_account_dimension on the pandas df.
+
+    :param table: the query results table.
+    :return: the fact table, with account_code and maker_code instead of the account columns and maker_id, and the
+    account df indexed by account_code.
+    """
+    account_codes = get_codes(table['account_id'])
+    maker_codes = get_codes(table['maker_id'])
+
+    # the first row of each account holds its dimension columns
+    _, first_rows = np.unique(account_codes.to_numpy(), return_index=True)
+    accounts = table.select(ACCOUNT_COLUMNS).take(first_rows).to_pandas()
+    accounts.index.name = 'account_code'
+
+    table = table.drop(ACCOUNT_COLUMNS + ['maker_id'])
+    table = table.append_column('account_code', account_codes).append_column('maker_code', maker_codes)
+
+    return table, accounts
+
+
+def half_year_arrow(months: pa.ChunkedArray):
+    """
+    Get the half year period of each 'YYYY-MM' month, the same as half_year.
+    """
+    # empty results converted from pandas have null typed columns
+    months = pc.cast(months, pa.string())
+    year = pc.utf8_slice_codeunits(months, 0, 4)
+    month_num = pc.cast(pc.utf8_slice_codeunits(months, 5, 7), pa.int8())
+    half = pc.if_else(pc.less_equal(month_num, 6), 'H1', 'H2')
+
+    return pc.binary_join_element_wise(half, year, ' ')
+
+
+def to_timestamp(days: pa.ChunkedArray):
+    """
+    Get the days as timestamps, from dates or 'YYYY-MM-DD' strings.
+    """
+    return pc.cast(days, pa.timestamp('ns'))
+
+
+def to_pandas(table: pa.Table) -> DataFrame:
+    """
+    Convert the table to a pandas df once all the derived columns are added. Each column gets its own block, so the
+    numeric columns without nulls are not copied, and the table's buffers are released while converting.
+    """
+    return table.to_pandas(split_blocks=True, self_destruct=True)
@@ -0,0 +1,90 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from data.metrics import FILTERS
+
+
+# Maker x month activity, bit-packed along the makers so that each month is a row of bytes (8 makers per byte).
+# maker_codes / maker_accounts: the maker code and account code of each bit; active: the months each maker was
+# active in; cohorts: only the first active month of each maker.
+ActivityBitmap = namedtuple('ActivityBitmap', ['months', 'maker_codes', 'maker_accounts', 'active', 'cohorts'])
+
+# number of set bits for every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(packed):
+    """
+    Count the set bits in the last axis of a bit-packed array.
+    """
+    return _POPCOUNT[packed].sum(axis=-1, dtype=np.int64)
+
+
+def build_activity_bitmap(df: DataFrame):
+    """
+    Build the bit-packed maker x month activity matrix used for cohort retention.
+    A maker counts as active in a month under the Active Makers rule (>= 5 generic interactions & >= 5 mins).
+
+    :param df: the interaction df.
+    :return: an ActivityBitmap
+    """
+    active_df = df[FILTERS['active_maker'](df)]
+
+    bits, maker_codes = pd.factorize(active_df['maker_code'])
+    # every calendar month between the first and the last, so that months since counts calendar months even if a month
+    # has no rows
+    months = pd.period_range(df['engaged_month'].min(), df['engaged_month'].max(), freq='M')
+    months = months.strftime('%Y-%m').to_numpy()
+    month_codes = np.searchsorted(months, active_df['engaged_month'].to_numpy())
+
+    active = np.zeros((len(months), len(maker_codes)), dtype=bool)
+    active[month_codes, bits] = True
+
+    # first active month of each maker, as a one-hot month row
+    cohorts = np.zeros_like(active)
+    cohorts[active.argmax(axis=0), np.arange(len(maker_codes))] = True
+
+    # one account per maker, taken from their first row
+    first_rows = pd.Series(np.arange(len(active_df))).groupby(bits).first().to_numpy()
+    maker_accounts = active_df['account_code'].to_numpy()[first_rows]
+
+    return ActivityBitmap(months, np.asarray(maker_codes), maker_accounts, np.packbits(active, axis=1),
+                          np.packbits(cohorts, axis=1))
+
+
+def get_retention_triangle(bitmap: ActivityBitmap, start_month, end_month, account_codes=None):
+    """
+    Get the cohort retention triangle: for each first-active-month cohort, the share of its makers still active
+    N months later.
+
+    :param bitmap: the ActivityBitmap
+    :param start_month: the first cohort month
+    :param end_month: the last month counted for activity
+    :param account_codes: (optional) only include makers from these accounts, e.g. the accounts of an ARR bracket
+    :return: a df of retention rates (cohort month x months since), and a series of the cohort sizes.
+    """
+    lo = np.searchsorted(bitmap.months, start_month, side='left')
+    hi = np.searchsorted(bitmap.months, end_month, side='right')
+    months = bitmap.months[lo:hi]
+    active = bitmap.active[lo:hi]
+    cohorts = bitmap.cohorts[lo:hi]
+    if account_codes is not None:
+        cohorts = cohorts & np.packbits(np.isin(bitmap.maker_accounts, account_codes))
+
+    n = len(months)
+    counts = np.zeros((n, n), dtype=np.int64)
+    for k in range(n):
+        counts[:n - k, k] = popcount(cohorts[:n - k] & active[k:])
+
+    sizes = popcount(cohorts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = counts / sizes[:, None]
+    # months beyond the end of the selected time frame are unknown, not zero
+    rates[np.arange(n)[:, None] + np.arange(n)[None, :] >= n] = np.nan
+
+    retention = DataFrame(rates, index=pd.Index(months, name='cohort'),
+                          columns=pd.Index(range(n), name='months_since'))
+    cohort_sizes = pd.Series(sizes, index=retention.index, name='cohort_size')
+
+    return retention, cohort_sizes
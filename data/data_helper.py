@@ -1,40 +1,126 @@
+import os
 import streamlit as st
 import pandas as pd
-from kyber_dwh import DataWarehouse
-from data.queries import interaction_query, survey_query
-from data.helper_functions import get_binned_arr, half_year
+from data.queries import interaction_query, survey_query, survey_summary_query, QUERIES
+from data.helper_functions import split_account_dimension, half_year
+from data.arrow_helper import split_account_dimension_arrow, half_year_arrow, to_timestamp, to_pandas
+from data.cohorts import build_activity_bitmap
+from data.sketches import build_quantile_sketches, ENGAGED_TIME_SKETCH_KEYS, ENGAGED_TIME_MONTH_SKETCH_KEYS
+from data.warehouse import ConnectionPool, LocalWarehouse, POOL_SIZE
 
-st.cache(allow_output_mutation=True)
+# 'rows' loads every maker-day survey row, 'summary' computes the days between purchases in the warehouse and only loads
+# one row per maker, account and year
+SURVEY_QUERY_MODE = os.environ.get('SURVEY_QUERY_MODE', 'rows')
+
+# the number of warehouse connections shared by all the sessions
+DWH_POOL_SIZE = int(os.environ.get('DWH_POOL_SIZE', POOL_SIZE))
+
+# 'arrow' fetches the results as Arrow tables and derives the columns with Arrow compute before converting to pandas,
+# 'pandas' fetches the results as pandas dfs
+DWH_RESULT_FORMAT = os.environ.get('DWH_RESULT_FORMAT', 'arrow')
+
+# (optional) a directory of saved query results (<query name>.parquet) served instead of the warehouse
+DWH_LOCAL_PATH = os.environ.get('DWH_LOCAL_PATH')
 
 
 def get_dwh():
+    if DWH_LOCAL_PATH:
+        return LocalWarehouse(DWH_LOCAL_PATH, QUERIES)
+    # only imported for the warehouse, so the saved results are served without the private client installed
+    from kyber_dwh import DataWarehouse
     return DataWarehouse(use_realtime_prod_data=True)
 
 
+@st.cache_resource  # This shares the warm warehouse connections across sessions and reruns
+def get_dwh_pool():
+    return ConnectionPool(get_dwh, size=DWH_POOL_SIZE)
+
+
+def add_interaction_columns(table):
+    return table.append_column('half_year_period', half_year_arrow(table['engaged_month']))
+
+
+def add_survey_columns(table):
+    table = table.set_column(table.schema.get_field_index('purchase_day'), 'purchase_day',
+                             to_timestamp(table['purchase_day']))
+    return table.append_column('half_year_period', half_year_arrow(table['purchase_month']))
+
+
+def move_to_end(table, column):
+    # the same column order as the pandas path, where the derived columns are added after the codes
+    return table.select([name for name in table.column_names if name != column] + [column])
+
+
 @st.cache_resource  # This prevents from reloading the data needlessly
 def get_data_for_interaction_metrics():
-    dwh = get_dwh()
+    dwh = get_dwh_pool()
     query = interaction_query
+    if DWH_RESULT_FORMAT == 'arrow':
+        # The half year periods are derived on each record batch as it arrives, the account/maker codes once all the
+        # results are in, and the table is only converted to pandas at the end
+        table = dwh.read_sql_arrow(query, add_interaction_columns)
+        table, accounts = split_account_dimension_arrow(table)
+        return to_pandas(move_to_end(table, 'half_year_period')), accounts
+
     df = dwh.read_sql_query(query)
 
-    # Add binned arr
-    df['account_arr_binned'] = get_binned_arr(df)
+    # Split the account columns into a dimension table, ARR is binned per account with get_binned_arr
+    df, accounts = split_account_dimension(df)
     # Add half year periods
     df['half_year_period'] = df['engaged_month'].apply(half_year)
-    return df
+    return df, accounts
 
 
 @st.cache_resource  # This prevents from reloading the data needlessly
 def get_data_for_survey_frequency_metrics():
-    dwh = get_dwh()
+    dwh = get_dwh_pool()
     query = survey_query
+    if DWH_RESULT_FORMAT == 'arrow':
+        table = dwh.read_sql_arrow(query, add_survey_columns)
+        table, accounts = split_account_dimension_arrow(table)
+        return to_pandas(move_to_end(table, 'half_year_period')), accounts
+
     df = dwh.read_sql_query(query)
 
     # Handle dates
     df['purchase_day'] = pd.to_datetime(df['purchase_day'])
-    # Add binned arr
-    df['account_arr_binned'] = get_binned_arr(df)
+    # Split the account columns into a dimension table, ARR is binned per account with get_binned_arr
+    df, accounts = split_account_dimension(df)
     # Add half year periods
     df['half_year_period'] = df['purchase_month'].apply(half_year)
 
-    return df
+    return df, accounts
+
+
+@st.cache_resource  # This prevents from reloading the data needlessly
+def get_data_for_survey_frequency_summary():
+    dwh = get_dwh_pool()
+    query = survey_summary_query
+    if DWH_RESULT_FORMAT == 'arrow':
+        table, accounts = split_account_dimension_arrow(dwh.read_sql_arrow(query))
+        return to_pandas(table), accounts
+
+    df = dwh.read_sql_query(query)
+
+    # Split the account columns into a dimension table, ARR is binned per account with get_binned_arr
+    df, accounts = split_account_dimension(df)
+
+    return df, accounts
+
+
+@st.cache_resource  # This prevents from rebuilding the activity bitmap needlessly
+def get_activity_bitmap_for_retention():
+    df, accounts = get_data_for_interaction_metrics()
+    return build_activity_bitmap(df)
+
+
+@st.cache_resource  # This prevents from rebuilding the sketches needlessly
+def get_engaged_time_sketches():
+    df, accounts = get_data_for_interaction_metrics()
+    return build_quantile_sketches(df, ENGAGED_TIME_SKETCH_KEYS, 'total_engaged_time_in_m')
+
+
+@st.cache_resource  # This prevents from rebuilding the sketches needlessly
+def get_engaged_time_month_sketches():
+    df, accounts = get_data_for_interaction_metrics()
+    return build_quantile_sketches(df, ENGAGED_TIME_MONTH_SKETCH_KEYS, 'total_engaged_time_in_m')
@@ -0,0 +1,71 @@
+import io
+from pandas import DataFrame
+
+
+# export format -> (file extension, mime type)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+# number of rows serialized at a time
+CHUNK_ROWS = 50000
+
+
+def _iter_chunks(df: DataFrame, chunk_rows=CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def write_csv(df: DataFrame, buf, chunk_rows=CHUNK_ROWS):
+    buf.write(df.iloc[:0].to_csv(index=False).encode())
+    for chunk in _iter_chunks(df, chunk_rows):
+        buf.write(chunk.to_csv(index=False, header=False).encode())
+
+
+def write_parquet(df: DataFrame, buf, chunk_rows=CHUNK_ROWS):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # parquet column names must be strings, e.g. the months since columns of the retention table
+    df = df.rename(columns=str)
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(buf, schema) as writer:
+        for chunk in _iter_chunks(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def write_excel(df: DataFrame, buf, chunk_rows=CHUNK_ROWS):
+    from openpyxl import Workbook
+
+    # a write-only workbook streams the rows instead of keeping every cell in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('data')
+    sheet.append([str(column) for column in df.columns])
+    for chunk in _iter_chunks(df, chunk_rows):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False):
+            sheet.append([value if value is None or isinstance(value, (int, float)) else str(value) for value in row])
+    workbook.save(buf)
+
+
+WRITERS = {
+    'CSV': write_csv,
+    'Parquet': write_parquet,
+    'Excel': write_excel,
+}
+
+
+def export_table(df: DataFrame, export_format):
+    """
+    Serialize the aggregated data of a chart for download. The df is written chunk by chunk into the buffer.
+
+    :param df: the aggregated df.
+    :param export_format: one of EXPORT_FORMATS.
+    :return: the serialized bytes.
+    """
+    buf = io.BytesIO()
+    WRITERS[export_format](df, buf)
+
+    return buf.getvalue()
@@ -1,23 +1,73 @@
 import pandas as pd
-from pandas import DataFrame
+from pandas import DataFrame, Series
 import numpy as np
 
 
+# default edges between the ARR brackets
+ARR_BIN_EDGES = [50000, 100000]
+
+# account columns which are moved from the query results to the account dimension table
+ACCOUNT_COLUMNS = ['account_id', 'account_name', 'total_account_arr']
+
+
 # helper functions
-def get_binned_arr(df: DataFrame):
+def get_arr_labels(edges):
+    """
+    Get the labels of the ARR brackets between the given edges, e.g. ['<50k', '50-100k', '100k+'] for [50000, 100000].
+    """
+    ks = [f'{edge / 1000:g}' for edge in edges]
+    labels = [f'<{ks[0]}k'] + [f'{lo}-{hi}k' for lo, hi in zip(ks[:-1], ks[1:])] + [f'{ks[-1]}k+']
+
+    return labels
+
+
+def get_binned_arr(df: DataFrame, edges=ARR_BIN_EDGES):
     """
     Get the account_ARR_binned column for visualisations for metrics across ARR brackets.
-    The ARR brackets are ['<0k', '50-100k', '100k+']
+    The default ARR brackets are ['<50k', '50-100k', '100k+']
 
-    :param df: the input dataframe.
-    :return: the column of account ARR discretized into the above brackets.
+    :param df: the input dataframe, usually the account dimension table so that each account is only binned once.
+    :param edges: the edges between the ARR brackets.
+    :return: the column of account ARR discretized into the brackets.
     """
 
-    bins = [-float('inf'), 50000, 100000, float('inf')]
-    labels = ['<50k', '50-100k', '100k+']
+    bins = [-float('inf')] + list(edges) + [float('inf')]
+    labels = get_arr_labels(edges)
     binned_arr = pd.cut(df['total_account_arr'], bins=bins, labels=labels, include_lowest=True)
 
-    return binned_arr
+    return binned_arr.rename('account_arr_binned')
+
+
+def split_account_dimension(df: DataFrame):
+    """
+    Split the query results into a fact table keyed by integer account and maker codes, and an account dimension table.
+
+    :param df: the query results.
+    :return: the fact df, with account_code and maker_code instead of the account columns and maker_id, and the
+    account df indexed by account_code.
+    """
+    account_codes = df.groupby('account_id', dropna=False, sort=True).ngroup().to_numpy()
+    maker_codes = df.groupby('maker_id', dropna=False, sort=True).ngroup().to_numpy()
+
+    accounts = df[ACCOUNT_COLUMNS].groupby(account_codes).first()
+    accounts.index.name = 'account_code'
+
+    df = df.drop(columns=ACCOUNT_COLUMNS + ['maker_id'])
+    df['account_code'] = account_codes.astype('int32')
+    df['maker_code'] = maker_codes.astype('int32')
+
+    return df, accounts
+
+
+def lookup_by_code(dimension: Series, codes: Series):
+    """
+    Join a column of a dimension table onto the rows of a fact table, by code lookup.
+
+    :param dimension: the dimension column, indexed by code (0, 1, 2, ...).
+    :param codes: the code column of the fact table.
+    :return: the dimension column aligned to the rows of the fact table.
+    """
+    return Series(dimension.array.take(codes.to_numpy()), index=codes.index, name=dimension.name)
 
 
 def half_year(date):
@@ -50,8 +100,8 @@ def add_days_between_column(df: DataFrame):
     :param df: the survey df
     :return: the survey df with an added column of days between surveys
     """
-    df_days = df.sort_values(by=['maker_id', 'account_id', 'purchase_day'])
-    df_days['previous_date'] = df_days.groupby(['account_id', 'maker_id'])['purchase_day'].shift(1)
+    df_days = df.sort_values(by=['maker_code', 'account_code', 'purchase_day'])
+    df_days['previous_date'] = df_days.groupby(['account_code', 'maker_code'])['purchase_day'].shift(1)
 
     # Calculate days_from previous within each year
     df_days['days_from_previous'] = np.where(df_days['purchase_day'].dt.year == df_days['previous_date'].dt.year,
@@ -65,6 +115,65 @@ def add_days_between_column(df: DataFrame):
     return df_days
 
 
+def summarise_survey(df_days: DataFrame):
+    """
+    Summarise the survey df into one row per maker, account and year, the same as survey_summary_query does in the
+    warehouse.
+
+    :param df_days: the survey df with the days between column.
+    :return: the survey summary df, with the number of purchase days, the number and total of the days between
+    purchases, and the single/multiple purchaser flags of the maker in the year.
+    """
+    summary = df_days.groupby(['maker_code', 'account_code', 'purchase_year'], as_index=False).agg(
+        num_purchase_days=('purchase_day', 'size'),
+        num_purchase_gaps=('days_from_previous', 'count'),
+        total_days_between=('days_from_previous', 'sum')
+    )
+    maker_year = summary.groupby(['maker_code', 'purchase_year'])
+    summary['is_single_purchaser'] = (maker_year['num_purchase_days'].transform('sum') == 1).astype(int)
+    summary['is_multiple_purchaser'] = (maker_year['num_purchase_gaps'].transform('sum') > 0).astype(int)
+
+    return summary
+
+
+def get_purchaser_table(summary: DataFrame):
+    """
+    :param summary: the survey summary df.
+    :return: the number of Single Purchasers and Multiple Purchasers, and the Average Days Between purchases of
+    multiple purchasers, by year.
+    """
+    single = summary[summary['is_single_purchaser'] == 1]
+    multiple = summary[summary['is_multiple_purchaser'] == 1]
+    summary_year = summary.groupby('purchase_year')
+    tbl = DataFrame({
+        'Single Purchasers': single.groupby('purchase_year')['maker_code'].nunique(),
+        'Multiple Purchasers': multiple.groupby('purchase_year')['maker_code'].nunique(),
+        'Average Days Between': summary_year['total_days_between'].sum() / summary_year['num_purchase_gaps'].sum()
+    })
+
+    return tbl
+
+
+def in_purchase_month_range(summary: DataFrame, start_month, end_month):
+    """
+    :param summary: the survey summary df, with the purchase_months bitmask (bit 0 for January) of each year.
+    :param start_month: the first month of the time frame.
+    :param end_month: the last month of the time frame.
+    :return: a boolean column, True for the rows with a purchase in the time frame.
+    """
+    year = summary['purchase_year'].astype(int).to_numpy()
+    start_year, start_month_num = int(start_month[:4]), int(start_month[5:])
+    end_year, end_month_num = int(end_month[:4]), int(end_month[5:])
+
+    first = np.where(year == start_year, start_month_num, 1)
+    first[year < start_year] = 13
+    last = np.where(year == end_year, end_month_num, 12)
+    last[year > end_year] = 0
+    range_bits = ((1 << last) - 1) & ~((1 << (first - 1)) - 1)
+
+    return Series((summary['purchase_months'].to_numpy().astype(np.int64) & range_bits) != 0, index=summary.index)
+
+
 def adjusted_start_month(month):
     year = int(month[:4])
     month_num = int(month[5:])
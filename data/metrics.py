@@ -0,0 +1,102 @@
+from collections import namedtuple
+from pandas import DataFrame
+from data.helper_functions import lookup_by_code
+
+
+# A metric declares which rows it counts (filter), what it is grouped by (keys) and how it is aggregated (column, agg).
+Metric = namedtuple('Metric', ['name', 'keys', 'column', 'agg', 'filter'])
+
+MONTH = ('engaged_month',)
+ARR_HALF_YEAR = ('account_arr_binned', 'half_year_period')
+SURVEY_YEAR_ARR = ('purchase_year', 'account_arr_binned')
+
+# Row filters, referenced by name from the metrics below.
+FILTERS = {
+    # A maker is active if they have done >= 5 generic interactions & have viewed a page >= 5 mins
+    'active_maker': lambda df: (df['total_engaged_time_in_m'] >= 5) & (df['num_unique_interactions'] >= 5),
+    # Only including multiple purchasers for the days between metric
+    'multiple_purchaser': lambda df: df['days_from_previous'].notna(),
+}
+
+METRICS = {}
+
+
+def register_metric(name, keys, column, agg, filter=None):
+    """
+    Add a metric to the registry.
+
+    :param name: the name of the metric, also the name of its column in the aggregated df.
+    :param keys: tuple of the columns to group by.
+    :param column: the column to aggregate.
+    :param agg: the aggregation passed to pandas, e.g. 'sum', 'mean', 'nunique'.
+    :param filter: (optional) name of a row filter in FILTERS, rows failing it are left out of the aggregation.
+    :return: the registered metric.
+    """
+    if filter is not None and filter not in FILTERS:
+        raise KeyError(f'Unknown filter: {filter}')
+    metric = Metric(name, tuple(keys), column, agg, filter)
+    METRICS[name] = metric
+    return metric
+
+
+# Interactions
+register_metric('active_generic_makers', MONTH, 'generic_active_maker', 'sum', filter='active_maker')
+register_metric('active_results_makers', MONTH, 'results_active_maker', 'sum', filter='active_maker')
+register_metric('avg_engaged_time_in_m', MONTH, 'total_engaged_time_in_m', 'mean')
+register_metric('avg_engaged_days', MONTH, 'engaged_days', 'mean')
+register_metric('arr_avg_engaged_time_in_m', ARR_HALF_YEAR, 'total_engaged_time_in_m', 'mean')
+register_metric('arr_number_of_makers', ARR_HALF_YEAR, 'maker_code', 'nunique')
+register_metric('arr_avg_engaged_days', ARR_HALF_YEAR, 'engaged_days', 'mean')
+
+# Survey frequencies
+register_metric('avg_days_between', SURVEY_YEAR_ARR, 'days_from_previous', 'mean', filter='multiple_purchaser')
+register_metric('number_of_makers', SURVEY_YEAR_ARR, 'maker_code', 'nunique')
+register_metric('number_of_accounts', SURVEY_YEAR_ARR, 'account_code', 'nunique')
+
+# Survey frequencies from the survey summary query
+register_metric('sum_days_between', SURVEY_YEAR_ARR, 'total_days_between', 'sum')
+register_metric('sum_purchase_gaps', SURVEY_YEAR_ARR, 'num_purchase_gaps', 'sum')
+
+
+def compute_metrics(df: DataFrame, names, dimensions=None):
+    """
+    Compute the given metrics on df, with a single groupby pass per set of group keys.
+
+    Metrics sharing keys are fused: each filter is evaluated once, rows failing a metric's filter are masked to NaN in
+    that metric's column only (NaN is skipped by sum, mean and nunique), and all the columns are aggregated together.
+
+    :param df: the input dataframe.
+    :param names: the names of the metrics to compute.
+    :param dimensions: (optional) group keys which are not columns of df, as dimension columns indexed by code, e.g. the
+    account_arr_binned column of the account dimension table. They are joined onto df by code lookup.
+    :return: a dictionary of metric name -> the aggregated df of its key set, which holds the keys and the columns of
+    all the requested metrics sharing those keys.
+    """
+    passes = {}
+    for name in names:
+        metric = METRICS[name]
+        passes.setdefault(metric.keys, []).append(metric)
+
+    masks = {}
+    results = {}
+    for keys, metrics in passes.items():
+        columns = {key: df[key] if key in df else lookup_by_code(dimensions[key], df[dimensions[key].index.name])
+                   for key in keys}
+        for metric in metrics:
+            values = df[metric.column]
+            if metric.filter is not None:
+                if metric.filter not in masks:
+                    masks[metric.filter] = FILTERS[metric.filter](df)
+                if values.dtype == bool:
+                    values = values.astype(float)
+                values = values.where(masks[metric.filter])
+            columns[metric.name] = values
+
+        agg = DataFrame(columns).groupby(list(keys)).agg(
+            **{metric.name: (metric.name, metric.agg) for metric in metrics}
+        ).reset_index()
+
+        for metric in metrics:
+            results[metric.name] = agg
+
+    return results
@@ -0,0 +1,312 @@
+import logging
+from collections import namedtuple
+from data.helper_functions import adjusted_start_month, adjusted_end_month, add_days_between_column, \
+    get_binned_arr, lookup_by_code, summarise_survey, get_purchaser_table, in_purchase_month_range
+from data.metrics import compute_metrics
+from data.cohorts import get_retention_triangle
+from data.sketches import get_quantiles, merge_sketches
+from data.plot_helper import plot_active_makers, plot_engaged_time, plot_arr_engaged_time, plot_days_engaged, \
+    plot_arr_days_engaged, plot_arr_days_between, plot_maker_and_acct_by_arr_year, plot_engaged_time_percentiles, \
+    plot_arr_engaged_time_percentiles, plot_cohort_retention
+
+logger = logging.getLogger(__name__)
+
+# A pipeline stage: it is computed from the nodes (or inputs) it depends on (deps) and the page parameters it reads
+# (params). Only the nodes with cache=True keep their result between reruns, e.g. aggregates and chart pngs but not
+# filtered copies of the data.
+Node = namedtuple('Node', ['name', 'func', 'deps', 'params', 'cache'])
+
+NODES = {}
+
+
+def node(deps=(), params=(), cache=True):
+    """
+    Register the decorated function as a pipeline node, named after the function. The results of deps are passed as
+    positional arguments and params as keyword arguments.
+    """
+    def register(func):
+        NODES[func.__name__] = Node(func.__name__, func, tuple(deps), tuple(params), cache)
+        return func
+    return register
+
+
+def _freeze(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def evaluate_nodes(names, params, inputs, cache):
+    """
+    Get the results of the given nodes, recomputing only the nodes whose inputs changed since they were cached.
+
+    The key of a node is made of its params and the keys of its deps, so it is known without computing anything. A
+    cached node whose key is unchanged is reused and its deps are not even evaluated.
+
+    :param names: the names of the nodes to get.
+    :param params: the page parameters, e.g. the date range and the selected account.
+    :param inputs: input name -> the loader of the input data. The data version is the identity of the loaded object.
+    :param cache: the cache of the session (a dict), node name -> (key, result).
+    :return: a dictionary of node name -> result.
+    """
+    input_refs = cache.setdefault('inputs', {})
+    keys = {}
+    results = {}
+
+    def get_key(name):
+        if name not in keys:
+            if name in inputs:
+                data = inputs[name]()
+                # keep the loaded object alive, so its identity can't be reused by newer data
+                input_refs[name] = data
+                keys[name] = ('input', id(data))
+            else:
+                node_ = NODES[name]
+                keys[name] = (tuple(_freeze(params[param]) for param in node_.params),
+                              tuple(get_key(dep) for dep in node_.deps))
+        return keys[name]
+
+    def get_result(name):
+        if name not in results:
+            if name in inputs:
+                results[name] = input_refs[name]
+            else:
+                node_ = NODES[name]
+                key = get_key(name)
+                cached = cache.get(name)
+                if cached is not None and cached[0] == key:
+                    results[name] = cached[1]
+                else:
+                    logger.debug('Recomputing %s', name)
+                    results[name] = node_.func(*[get_result(dep) for dep in node_.deps],
+                                               **{param: params[param] for param in node_.params})
+                    if node_.cache:
+                        cache[name] = (key, results[name])
+        return results[name]
+
+    for name in names:
+        get_key(name)
+
+    return {name: get_result(name) for name in names}
+
+
+# Interactions
+@node(deps=['interaction_data'], params=['arr_bin_edges'])
+def interaction_bins(interaction_data, arr_bin_edges):
+    df, accounts = interaction_data
+    return get_binned_arr(accounts, arr_bin_edges)
+
+
+@node(deps=['interaction_data'], params=['start_month', 'end_month'], cache=False)
+def interaction_df(interaction_data, start_month, end_month):
+    df, accounts = interaction_data
+    return df[(df['engaged_month'] >= start_month) & (df['engaged_month'] <= end_month)]
+
+
+@node(deps=['interaction_df'], params=['start_month', 'end_month'], cache=False)
+def arr_interaction_df(df, start_month, end_month):
+    arr_start_month = adjusted_start_month(start_month)
+    arr_end_month = adjusted_end_month(end_month)
+    return df[(df['engaged_month'] >= arr_start_month) & (df['engaged_month'] <= arr_end_month)]
+
+
+@node(deps=['arr_interaction_df'])
+def arr_is_empty(arr_df):
+    return arr_df.empty
+
+
+@node(deps=['interaction_df', 'interaction_data'])
+def account_options(df, interaction_data):
+    _, accounts = interaction_data
+    return sorted(accounts.loc[df['account_code'].unique(), 'account_name'].unique())
+
+
+@node(deps=['interaction_data'], params=['account_name'])
+def selected_account_codes(interaction_data, account_name):
+    if account_name is None:
+        return None
+    _, accounts = interaction_data
+    return accounts.index[accounts['account_name'] == account_name]
+
+
+@node(deps=['interaction_df'])
+def month_aggs(df):
+    # active makers and the overall monthly engagement share the month keys, so they are aggregated in one pass
+    return compute_metrics(df, ['active_generic_makers', 'active_results_makers', 'avg_engaged_time_in_m',
+                                'avg_engaged_days'])
+
+
+@node(deps=['interaction_df', 'selected_account_codes'])
+def account_month_aggs(df, account_codes):
+    if account_codes is None:
+        return None
+    return compute_metrics(df[df['account_code'].isin(account_codes)], ['avg_engaged_time_in_m', 'avg_engaged_days'])
+
+
+@node(deps=['interaction_df', 'arr_interaction_df', 'interaction_bins'])
+def arr_aggs(df, arr_df, account_bins):
+    # If the selected time frame does not contain at least one entire half year period, the ARR plots are done with the
+    # default time frame
+    if arr_df.empty:
+        arr_df = df
+    return compute_metrics(arr_df, ['arr_avg_engaged_time_in_m', 'arr_number_of_makers', 'arr_avg_engaged_days'],
+                           {'account_arr_binned': account_bins})
+
+
+@node(deps=['month_aggs'])
+def chart1(aggs):
+    img1 = plot_active_makers(aggs['active_generic_makers'])
+    table1 = aggs['active_generic_makers'][['engaged_month', 'active_generic_makers', 'active_results_makers']]
+    return {"img1": img1, "table1": table1}
+
+
+@node(deps=['month_aggs', 'account_month_aggs'])
+def chart2(aggs, account_aggs):
+    aggs = account_aggs or aggs
+    img2 = plot_engaged_time(aggs['avg_engaged_time_in_m'])
+    table2 = aggs['avg_engaged_time_in_m'][['engaged_month', 'avg_engaged_time_in_m']]
+    return {"img2": img2, "table2": table2}
+
+
+@node(deps=['arr_aggs'])
+def chart3(aggs):
+    img3 = plot_arr_engaged_time(aggs['arr_avg_engaged_time_in_m'])
+    table3 = aggs['arr_avg_engaged_time_in_m'][['account_arr_binned', 'half_year_period', 'arr_avg_engaged_time_in_m',
+                                                'arr_number_of_makers']]
+    return {"img3": img3, "table3": table3}
+
+
+@node(deps=['month_aggs', 'account_month_aggs'])
+def chart4(aggs, account_aggs):
+    aggs = account_aggs or aggs
+    img4 = plot_days_engaged(aggs['avg_engaged_days'])
+    table4 = aggs['avg_engaged_days'][['engaged_month', 'avg_engaged_days']]
+    return {"img4": img4, "table4": table4}
+
+
+@node(deps=['arr_aggs'])
+def chart5(aggs):
+    img5 = plot_arr_days_engaged(aggs['arr_avg_engaged_days'])
+    table5 = aggs['arr_avg_engaged_days'][['account_arr_binned', 'half_year_period', 'arr_avg_engaged_days']]
+    return {"img5": img5, "table5": table5}
+
+
+# Engaged time percentiles, from merging the engaged time sketches of the selection
+@node(deps=['engaged_time_sketches', 'interaction_bins'])
+def arr_engaged_time_sketches(sketches, account_bins):
+    # roll the account sketches up into one sketch per month and ARR bracket, once per set of brackets
+    sketches = sketches.assign(account_arr_binned=lookup_by_code(account_bins, sketches['account_code']))
+    return merge_sketches(sketches, ['engaged_month', 'half_year_period', 'account_arr_binned'])
+
+
+@node(deps=['engaged_time_month_sketches', 'engaged_time_sketches', 'selected_account_codes'],
+      params=['start_month', 'end_month'])
+def chart2_percentiles(month_sketches, account_sketches, account_codes, start_month, end_month):
+    # without an account selected the roll-up of every account is used, instead of merging every account sketch
+    if account_codes is None:
+        sketches = month_sketches
+    else:
+        sketches = account_sketches[account_sketches['account_code'].isin(account_codes)]
+
+    in_range = (sketches['engaged_month'] >= start_month) & (sketches['engaged_month'] <= end_month)
+    table2 = get_quantiles(sketches[in_range], ['engaged_month'])
+    img2 = plot_engaged_time_percentiles(table2)
+    return {"img2": img2, "table2": table2}
+
+
+@node(deps=['arr_engaged_time_sketches'], params=['start_month', 'end_month'])
+def chart3_percentiles(sketches, start_month, end_month):
+    arr_in_range = ((sketches['engaged_month'] >= adjusted_start_month(start_month))
+                    & (sketches['engaged_month'] <= adjusted_end_month(end_month)))
+    # If the selected time frame does not contain at least one entire half year period, the ARR plots are done with the
+    # default time frame
+    if not arr_in_range.any():
+        arr_in_range = (sketches['engaged_month'] >= start_month) & (sketches['engaged_month'] <= end_month)
+
+    table3 = get_quantiles(sketches[arr_in_range], ['account_arr_binned', 'half_year_period'])
+    img3 = plot_arr_engaged_time_percentiles(table3)
+    return {"img3": img3, "table3": table3}
+
+
+# Retention
+@node(deps=['activity_bitmap', 'interaction_bins'], params=['start_month', 'end_month', 'retention_arr_bin'])
+def chart8(bitmap, account_bins, start_month, end_month, retention_arr_bin):
+    account_codes = None if retention_arr_bin is None else account_bins.index[account_bins == retention_arr_bin]
+    retention, cohort_sizes = get_retention_triangle(bitmap, start_month, end_month, account_codes)
+    img8 = plot_cohort_retention(retention, cohort_sizes)
+    return {"img8": img8, "table8": retention.join(cohort_sizes).reset_index()}
+
+
+# Survey frequencies, from the maker-day survey rows
+@node(deps=['survey_data'], params=['arr_bin_edges'])
+def survey_bins(survey_data, arr_bin_edges):
+    df, accounts = survey_data
+    return get_binned_arr(accounts, arr_bin_edges)
+
+
+@node(deps=['survey_data'])
+def survey_days(survey_data):
+    # days between purchases do not depend on the selected time frame
+    df, accounts = survey_data
+    return add_days_between_column(df)
+
+
+@node(deps=['survey_data'], params=['start_month', 'end_month'], cache=False)
+def survey_df(survey_data, start_month, end_month):
+    df, accounts = survey_data
+    return df[(df['purchase_month'] >= start_month) & (df['purchase_month'] <= end_month)]
+
+
+@node(deps=['survey_days'])
+def purchasers(df_days):
+    return {"purchasers": get_purchaser_table(summarise_survey(df_days))}
+
+
+@node(deps=['survey_days', 'survey_bins'])
+def chart6(df_days, account_bins):
+    aggs = compute_metrics(df_days, ['avg_days_between'], {'account_arr_binned': account_bins})
+    img6 = plot_arr_days_between(aggs['avg_days_between'])
+    table6 = aggs['avg_days_between'][['purchase_year', 'account_arr_binned', 'avg_days_between']]
+    return {"img6": img6, "table6": table6}
+
+
+@node(deps=['survey_df', 'survey_bins'])
+def chart7(df, account_bins):
+    aggs = compute_metrics(df, ['number_of_makers', 'number_of_accounts'], {'account_arr_binned': account_bins})
+    img7 = plot_maker_and_acct_by_arr_year(aggs['number_of_makers'])
+    table7 = aggs['number_of_makers'][['purchase_year', 'account_arr_binned', 'number_of_makers', 'number_of_accounts']]
+    return {"img7": img7, "table7": table7}
+
+
+# Survey frequencies, from the survey summary computed in the warehouse
+@node(deps=['survey_summary'], params=['arr_bin_edges'])
+def summary_bins(survey_summary, arr_bin_edges):
+    df, accounts = survey_summary
+    return get_binned_arr(accounts, arr_bin_edges)
+
+
+@node(deps=['survey_summary'])
+def summary_purchasers(survey_summary):
+    df, accounts = survey_summary
+    return {"purchasers": get_purchaser_table(df)}
+
+
+@node(deps=['survey_summary', 'summary_bins'])
+def summary_chart6(survey_summary, account_bins):
+    df, accounts = survey_summary
+    aggs = compute_metrics(df, ['sum_days_between', 'sum_purchase_gaps'], {'account_arr_binned': account_bins})
+    avg_between = aggs['sum_days_between']
+    avg_between['avg_days_between'] = avg_between['sum_days_between'] / avg_between['sum_purchase_gaps']
+
+    img6 = plot_arr_days_between(avg_between)
+    table6 = avg_between[['purchase_year', 'account_arr_binned', 'avg_days_between']]
+    return {"img6": img6, "table6": table6}
+
+
+@node(deps=['survey_summary', 'summary_bins'], params=['start_month', 'end_month'])
+def summary_chart7(survey_summary, account_bins, start_month, end_month):
+    df, accounts = survey_summary
+    in_range_df = df[in_purchase_month_range(df, start_month, end_month)]
+    aggs = compute_metrics(in_range_df, ['number_of_makers', 'number_of_accounts'],
+                           {'account_arr_binned': account_bins})
+    img7 = plot_maker_and_acct_by_arr_year(aggs['number_of_makers'])
+    table7 = aggs['number_of_makers'][['purchase_year', 'account_arr_binned', 'number_of_makers', 'number_of_accounts']]
+    return {"img7": img7, "table7": table7}
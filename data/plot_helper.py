@@ -1,23 +1,34 @@
 import io
 import seaborn as sns
 from matplotlib import pyplot as plt
-from data.helper_functions import get_ordered_half_years, add_days_between_column
+from data.helper_functions import get_ordered_half_years
 from pandas import DataFrame
 
 
+# the resolution st.pyplot used to render the figures at, the pngs are shown as they are
+PLOT_DPI = 200
+
+
+def fig_to_png(fig):
+    """
+    Render the figure once as a png, which is both shown on the page and downloaded, and close the figure.
+    """
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=PLOT_DPI, bbox_inches='tight')
+    plt.close(fig)
+
+    return buf.getvalue()
+
+
 # Interactions
-def plot_active_makers(df: DataFrame):
+def plot_active_makers(agg: DataFrame):
     """
-    :param df: the interaction df
+    :param agg: the interaction df aggregated by month, with the active_generic_makers and active_results_makers metrics
     :return: a stacked bar plot for number of Active Makers/ Active Results Makers
     """
-    # filter and get aggregated data
-    active_makers = df[
-        (df['total_engaged_time_in_m'] >= 5) & (df['num_unique_interactions'] >= 5)]
-    agg_active_makers = active_makers.groupby('engaged_month').agg(
-        generic_makers=('generic_active_maker', 'sum'),
-        results_makers=('results_active_maker', 'sum')
-    ).reset_index()
+    agg_active_makers = agg[['engaged_month']].copy()
+    agg_active_makers['generic_makers'] = agg['active_generic_makers']
+    agg_active_makers['results_makers'] = agg['active_results_makers']
     agg_active_makers['non_results_makers'] = agg_active_makers['generic_makers'] - agg_active_makers['results_makers']
 
     # plot
@@ -48,21 +59,16 @@ def plot_active_makers(df: DataFrame):
     plt.xticks(rotation=45)
     plt.legend()
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    buf_read = buf.read()
-    plt.close()
-
-    return fig, buf_read
+    return fig_to_png(fig)
 
 
-def plot_engaged_time(df: DataFrame):
+def plot_engaged_time(agg: DataFrame):
     """
-    :param df: the interaction df
+    :param agg: the interaction df aggregated by month, with the avg_engaged_time_in_m metric
     :return: a line plot for the Average Engaged Time per Maker per Month
     """
-    avg_engage_m = df.groupby(['engaged_month'])['total_engaged_time_in_m'].mean().round().reset_index()
+    avg_engage_m = agg[['engaged_month']].copy()
+    avg_engage_m['total_engaged_time_in_m'] = agg['avg_engaged_time_in_m'].round()
 
     fig = plt.figure(figsize=(10, 4))
     ax = sns.lineplot(data=avg_engage_m, x='engaged_month', y='total_engaged_time_in_m', marker='o')
@@ -82,29 +88,21 @@ def plot_engaged_time(df: DataFrame):
     plt.xticks(rotation=45)
     plt.tight_layout()
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    buf_read = buf.read()
-    plt.close()
-
-    return fig, buf_read
+    return fig_to_png(fig)
 
 
-def plot_arr_engaged_time(df: DataFrame):
+def plot_arr_engaged_time(agg: DataFrame):
     """
-    :param df: the interaction df
+    :param agg: the interaction df aggregated by ARR bracket and half year, with the arr_avg_engaged_time_in_m metric
     :return: a bar plot for Average Engaged Time across ARR brackets, with a stacked row chart showing the proportion
     of makers by ARR.
     """
     # get a sorted list of half year periods
-    ordered_half_years = get_ordered_half_years(df)
+    ordered_half_years = get_ordered_half_years(agg)
 
     # prepare aggregated data for bar plot
-    avg_engage_arr = df.groupby(['account_arr_binned', 'half_year_period']).agg(
-        avg_engaged_time_in_m=('total_engaged_time_in_m', lambda x: round(x.mean())),
-        number_of_makers=('maker_id', 'nunique')
-    ).reset_index()
+    avg_engage_arr = agg[['account_arr_binned', 'half_year_period']].copy()
+    avg_engage_arr['avg_engaged_time_in_m'] = agg['arr_avg_engaged_time_in_m'].round()
 
     fig = plt.figure(figsize=(10, 6))
 
@@ -120,22 +118,17 @@ def plot_arr_engaged_time(df: DataFrame):
     ax.legend(title='ARR')
     plt.tight_layout()
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    buf_read = buf.read()
-    plt.close()
+    return fig_to_png(fig)
 
-    return fig, buf_read
 
-
-def plot_days_engaged(df: DataFrame):
+def plot_days_engaged(agg: DataFrame):
     """
-    :param df: the interaction df
+    :param agg: the interaction df aggregated by month, with the avg_engaged_days metric
     :return: a line plot for Average Number of Days Engaged
     """
 
-    avg_days_engaged = df.groupby(['engaged_month'])['engaged_days'].mean().round(2).reset_index()
+    avg_days_engaged = agg[['engaged_month']].copy()
+    avg_days_engaged['engaged_days'] = agg['avg_engaged_days'].round(2)
 
     fig = plt.figure(figsize=(10, 4))
     ax = sns.lineplot(data=avg_days_engaged, x='engaged_month', y='engaged_days', marker='o')
@@ -151,27 +144,21 @@ def plot_days_engaged(df: DataFrame):
     plt.xticks(rotation=45)
     plt.tight_layout()
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    buf_read = buf.read()
-    plt.close()
-
-    return fig, buf_read
+    return fig_to_png(fig)
 
 
-def plot_arr_days_engaged(df: DataFrame):
+def plot_arr_days_engaged(agg: DataFrame):
     """
-    :param df: the interaction df
+    :param agg: the interaction df aggregated by ARR bracket and half year, with the arr_avg_engaged_days metric
     :return: a bar plot for Number of Days Engaged across ARR brackets, with a stacked row chart showing the proportion
     of makers by ARR.
     """
     # get a sorted list of half year periods
-    ordered_half_years = get_ordered_half_years(df)
+    ordered_half_years = get_ordered_half_years(agg)
 
     # prepare aggregated data for bar plot
-    avg_days_arr = df.groupby(['account_arr_binned', 'half_year_period'])['engaged_days'].mean().round(
-        2).reset_index()
+    avg_days_arr = agg[['account_arr_binned', 'half_year_period']].copy()
+    avg_days_arr['engaged_days'] = agg['arr_avg_engaged_days'].round(2)
 
     # bar plot
     fig = plt.figure(figsize=(10, 6))
@@ -188,27 +175,18 @@ def plot_arr_days_engaged(df: DataFrame):
 
     ax.legend(title="Account ARR", loc='lower right')
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    buf_read = buf.read()
-    plt.close()
-
-    return fig, buf_read
+    return fig_to_png(fig)
 
 
-def plot_arr_days_between(df: DataFrame):
+def plot_arr_days_between(agg: DataFrame):
     """
-     :param df: the survey df
+     :param agg: the survey df with days between purchases, aggregated by year and ARR bracket, with the
+     avg_days_between metric
      :return: a bar plot for Average Days Between Purchased across ARR brackets, with a stacked row chart showing the
      proportion of makers by ARR, and a stacked row chart showing the proportion of accounts by ARR
      """
-    df_days = add_days_between_column(df)
-    # Only including multiple purchasers for this metric
-    df_days = df_days.drop(df_days[df_days['days_from_previous'].isna()].index)
-
-    avg_between = df_days.groupby(['purchase_year', 'account_arr_binned'])['days_from_previous'].mean().round(
-        1).reset_index()
+    avg_between = agg[['purchase_year', 'account_arr_binned']].copy()
+    avg_between['days_from_previous'] = agg['avg_days_between'].round(1)
 
     fig = plt.figure(figsize=(8, 5))
 
@@ -225,27 +203,25 @@ def plot_arr_days_between(df: DataFrame):
     ax.legend(title="Account ARR", loc='lower right')
     plt.tight_layout()
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    buf_read = buf.read()
-    plt.close()
-
-    return fig, buf_read
+    return fig_to_png(fig)
 
 
-def plot_maker_and_acct_by_arr_year(df: DataFrame):
+def plot_maker_and_acct_by_arr_year(agg: DataFrame):
+    """
+    :param agg: the survey df aggregated by year and ARR bracket, with the number_of_makers and number_of_accounts
+    metrics
+    :return: stacked row charts showing the proportion of makers and of accounts by ARR
+    """
     fig, ax = plt.subplots(2, 1, figsize=(10, 4), gridspec_kw={'height_ratios': [1, 1]})
 
     # stacked row chart for makers proportion
-    makers_arr_year = df.groupby(['purchase_year', 'account_arr_binned']).agg(
-        number_of_makers=('maker_id', 'nunique'))
+    makers_arr_year = agg.set_index(['purchase_year', 'account_arr_binned'])[['number_of_makers']]
     makers_arr_tab = makers_arr_year.groupby(['purchase_year', 'account_arr_binned']).sum().unstack(fill_value=0)
     makers_arr_tab = makers_arr_tab.div(makers_arr_tab.sum(axis=1), axis=0) * 100
     makers_arr_tab.index = makers_arr_tab.index.astype('str')
 
     previous_width = [0] * len(makers_arr_tab.index)
-    labels = ['<50k', '50-100k', '100k+']
+    labels = list(makers_arr_tab.columns.get_level_values('account_arr_binned'))
     assert len(labels) == makers_arr_tab.shape[1], "Labels list must match the number of columns"
 
     palette = sns.color_palette("Set2", n_colors=makers_arr_tab.shape[1])
@@ -262,8 +238,7 @@ def plot_maker_and_acct_by_arr_year(df: DataFrame):
     ax[0].set_title('% of Makers by ARR')
 
     # stacked row chart for accounts proportion
-    accts_arr_year = df.groupby(['purchase_year', 'account_arr_binned']).agg(
-        number_of_accounts=('account_id', 'nunique'))
+    accts_arr_year = agg.set_index(['purchase_year', 'account_arr_binned'])[['number_of_accounts']]
     accts_arr_tab = accts_arr_year.groupby(['purchase_year', 'account_arr_binned']).sum().unstack(fill_value=0)
     accts_arr_tab = accts_arr_tab.div(accts_arr_tab.sum(axis=1), axis=0) * 100
     accts_arr_tab.index = accts_arr_tab.index.astype('str')
@@ -285,83 +260,78 @@ def plot_maker_and_acct_by_arr_year(df: DataFrame):
     ax[1].set_title('% of Accounts by ARR')
     ax[1].legend(loc='center left', bbox_to_anchor=(1, 0.5))
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    buf_read = buf.read()
-    plt.close()
-
-    return fig, buf_read
+    return fig_to_png(fig)
 
 
-def run_interaction_plotting_pipeline(df: DataFrame, arr_df: DataFrame, account_df: DataFrame):
+def plot_engaged_time_percentiles(quantiles: DataFrame):
     """
-    This pipeline function runs all the functions necessary to get the interaction metrics plots.
-
-    Args:
-        df (DataFrame): interaction_df, the input dataframe for active makers and engagement metrics.
-        arr_df (DataFrame): arr_interaction_df, the input dataframe for arr plots, which only include entire half years.
-        account_df:
-    Returns:
-        A dictionary of all the figure object (fig) to be plotted and a buffer (buf_read)
-        which is used for downloading the figures.
+    :param quantiles: the p25, p50, p75 and p90 of engaged time by month
+    :return: a line plot for the Median Engaged Time per Maker per Month, with the interquartile band and p90
     """
+    fig = plt.figure(figsize=(10, 4))
+    ax = sns.lineplot(data=quantiles, x='engaged_month', y='p50', marker='o', label='Median')
+    sns.lineplot(data=quantiles, x='engaged_month', y='p90', linestyle='--', color='grey', label='90th Percentile')
+
+    plt.fill_between(quantiles['engaged_month'], quantiles['p25'], quantiles['p75'], color='steelblue', alpha=0.4,
+                     label='25th - 75th Percentile')
 
-    # If the selected time frame does not contain at least one entire half year period, the ARR plots are done with the
-    # default time frame
-    if arr_df.empty:
-        arr_df = df
-    else:
-        arr_df = arr_df
-
-    # interaction metrics
-    fig1, img1 = plot_active_makers(df)
-    fig2, img2 = plot_engaged_time(account_df)
-    fig3, img3 = plot_arr_engaged_time(arr_df)
-    fig4, img4 = plot_days_engaged(account_df)
-    fig5, img5 = plot_arr_days_engaged(arr_df)
-
-    final_dic = dict(
-        {
-            "fig1": fig1,
-            "img1": img1,
-            "fig2": fig2,
-            "img2": img2,
-            "fig3": fig3,
-            "img3": img3,
-            "fig4": fig4,
-            "img4": img4,
-            "fig5": fig5,
-            "img5": img5
-        }
-    )
-
-    return final_dic
-
-
-def run_survey_plotting_pipeline(orig_df: DataFrame, df: DataFrame):
+    for x, y in zip(quantiles['engaged_month'], quantiles['p50']):
+        plt.text(x, y, f'{int(round(y))}', color='black', ha='center', va='bottom')
+
+    plt.title('Median Engagement Time (in minutes) per Month - Maker level')
+    plt.ylabel('Engagement Time (m)')
+    plt.xlabel('Month')
+    plt.xticks(rotation=45)
+    plt.legend()
+    plt.tight_layout()
+
+    return fig_to_png(fig)
+
+
+def plot_arr_engaged_time_percentiles(quantiles: DataFrame):
     """
-    This pipeline function runs all the functions necessary to get all the plots.
-
-    Args:
-        df (DataFrame): survey_df, the input dataframe for survey frequency metrics.
-        orig_df:
-    Returns:
-        A dictionary of all the figure object (fig) to be plotted and a buffer (buf_read)
-        which is used for downloading the figures.
+    :param quantiles: the p50 of engaged time by ARR bracket and half year
+    :return: a bar plot for Median Engaged Time across ARR brackets
     """
+    # get a sorted list of half year periods
+    ordered_half_years = get_ordered_half_years(quantiles)
+
+    median_engage_arr = quantiles[['account_arr_binned', 'half_year_period']].copy()
+    median_engage_arr['median_engaged_time_in_m'] = quantiles['p50'].round()
 
-    # survey freq metrics
-    fig6, img6 = plot_arr_days_between(orig_df)
-    fig7, img7 = plot_maker_and_acct_by_arr_year(df)
+    fig = plt.figure(figsize=(10, 6))
 
-    final_dic = dict(
-        {
-            "fig6": fig6,
-            "img6": img6,
-            "fig7": fig7,
-            "img7": img7
-        }
-    )
+    ax = sns.barplot(data=median_engage_arr, x='half_year_period', y='median_engaged_time_in_m',
+                     hue='account_arr_binned', palette='Set2', order=ordered_half_years)
+    plt.title('Median Engagement Time (in minutes) by ARR - Maker level')
+    plt.ylabel('Median Engagement Time (m)')
+    plt.xlabel('Six-month Period')
+
+    for m in range(len(ax.containers)):
+        ax.bar_label(ax.containers[m])
+
+    ax.legend(title='ARR')
+    plt.tight_layout()
+
+    return fig_to_png(fig)
+
+
+# Retention
+def plot_cohort_retention(retention: DataFrame, cohort_sizes):
+    """
+    :param retention: the retention rates by cohort month and months since the first active month
+    :param cohort_sizes: the number of makers in each cohort
+    :return: a heatmap of the % of each cohort's makers still active N months later
+    """
+    plot_df = retention * 100
+    plot_df.index = [f'{cohort} (n={size})' for cohort, size in cohort_sizes.items()]
+
+    fig = plt.figure(figsize=(12, 8))
+    ax = sns.heatmap(plot_df, annot=True, fmt='.0f', cmap='Blues', vmin=0, vmax=100, cbar_kws={'label': '% Retained'},
+                     annot_kws={'fontsize': 7})
+    ax.set_title('Active Maker Retention by First Active Month (%)')
+    ax.set_xlabel('Months Since First Active Month')
+    ax.set_ylabel('Cohort')
+    plt.tight_layout()
 
-    return final_dic
+    return fig_to_png(fig)
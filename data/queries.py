@@ -36,8 +36,8 @@ AND (acct.account_type <> 'Churned Customer' OR (acct.account_type = 'Churned Cu
 """
 
 
-survey_query = """
-WITH survey_count_day AS (
+survey_ctes = """
+survey_count_day AS (
     SELECT DISTINCT
     maker_id,
     (TO_CHAR(DATE_TRUNC('day', purchase_time), 'YYYY-MM-DD')) AS purchase_day,
@@ -57,7 +57,9 @@ survey_count_month AS (
     FROM survey_count_day
     GROUP BY maker_id, (TO_CHAR(DATE_TRUNC('month', DATE(purchase_day)), 'YYYY-MM'))
 )
+"""
 
+survey_select = """
 SELECT DISTINCT
     m.maker_id,
     acct.account_id,
@@ -78,4 +80,73 @@ AND (NOT m.is_attest OR m.is_attest IS NULL)
 AND m.has_ever_subscribed = 'true'
 AND (acct.account_type <> 'Churned Customer' OR (acct.account_type = 'Churned Customer' AND 
 (TO_CHAR(DATE_TRUNC('month', acct.churned_date), 'YYYY-MM')) <= scm.purchase_month))
-"""
\ No newline at end of file
+"""
+
+survey_query = f"""
+WITH {survey_ctes}
+{survey_select}"""
+
+# Survey frequencies summarised in the warehouse: one row per maker, account and year instead of one per purchase day.
+# {survey_rows_ctes} are CTEs ending with survey_rows, which has the columns of survey_query, {days_between} is the
+# dialect's day difference between previous_day and purchase_day.
+survey_summary_query_template = """
+WITH {survey_rows_ctes},
+
+purchase_gaps AS (
+    SELECT
+    maker_id,
+    account_id,
+    account_name,
+    total_account_arr,
+    purchase_year,
+    purchase_month,
+    purchase_day,
+    LAG(purchase_day) OVER (PARTITION BY account_id, maker_id ORDER BY purchase_day) AS previous_day
+    FROM survey_rows
+),
+
+maker_account_year AS (
+    SELECT
+    maker_id,
+    account_id,
+    account_name,
+    total_account_arr,
+    purchase_year,
+    SUM(DISTINCT 1 << (CAST(SUBSTRING(purchase_month, 6, 2) AS INT) - 1)) AS purchase_months,
+    COUNT(*) AS num_purchase_days,
+    COUNT(CASE WHEN SUBSTRING(previous_day, 1, 4) = purchase_year THEN 1 END) AS num_purchase_gaps,
+    SUM(CASE WHEN SUBSTRING(previous_day, 1, 4) = purchase_year THEN {days_between} END) AS total_days_between
+    FROM purchase_gaps
+    GROUP BY maker_id, account_id, account_name, total_account_arr, purchase_year
+)
+
+SELECT
+    maker_id,
+    account_id,
+    account_name,
+    total_account_arr,
+    purchase_year,
+    purchase_months,
+    num_purchase_days,
+    num_purchase_gaps,
+    total_days_between,
+    CASE WHEN SUM(num_purchase_days) OVER (PARTITION BY maker_id, purchase_year) = 1 THEN 1 ELSE 0 END
+    AS is_single_purchaser,
+    CASE WHEN SUM(num_purchase_gaps) OVER (PARTITION BY maker_id, purchase_year) > 0 THEN 1 ELSE 0 END
+    AS is_multiple_purchaser
+FROM maker_account_year
+"""
+
+survey_summary_query = survey_summary_query_template.format(
+    survey_rows_ctes=f"""{survey_ctes},
+
+survey_rows AS ({survey_select})""",
+    days_between='DATEDIFF(day, DATE(previous_day), DATE(purchase_day))'
+)
+
+# query name -> query, the names of the saved results served by LocalWarehouse
+QUERIES = {
+    'interaction': interaction_query,
+    'survey': survey_query,
+    'survey_summary': survey_summary_query,
+}
@@ -0,0 +1,91 @@
+import numpy as np
+from pandas import DataFrame
+
+
+# t-digest compression: a merged sketch keeps at most compression / 2 centroids per group
+COMPRESSION = 100
+
+ENGAGED_TIME_SKETCH_KEYS = ['engaged_month', 'half_year_period', 'account_code']
+# roll-up of every account, for the charts without an account selected
+ENGAGED_TIME_MONTH_SKETCH_KEYS = ['engaged_month', 'half_year_period']
+
+
+def _compress(centroids: DataFrame, keys, compression=COMPRESSION):
+    """
+    Merge the centroids of each group into at most compression / 2 centroids, with the t-digest k1 scale function
+    so the centroids near the tails stay small.
+
+    :param centroids: a df of the keys, and the mean and weight of each centroid.
+    :param keys: the columns to group by.
+    :param compression: the t-digest compression.
+    :return: the compressed centroids, sorted by keys and mean.
+    """
+    centroids = centroids.sort_values(keys + ['mean'])
+    weights = centroids.groupby(keys, observed=True, sort=False)['weight']
+    # quantile at the middle of each centroid, within its group
+    q = (weights.cumsum() - centroids['weight'] / 2) / weights.transform('sum')
+    k = compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+
+    centroids = centroids.assign(bin=np.floor(k).astype(int), weighted=centroids['mean'] * centroids['weight'])
+    merged = centroids.groupby(keys + ['bin'], observed=True, sort=False).agg(
+        weight=('weight', 'sum'),
+        weighted=('weighted', 'sum')
+    ).reset_index()
+    merged['mean'] = merged['weighted'] / merged['weight']
+
+    return merged[keys + ['mean', 'weight']]
+
+
+def build_quantile_sketches(df: DataFrame, keys, value, compression=COMPRESSION):
+    """
+    Build a quantile sketch of value for each group of keys.
+    The sketches of any subset of groups can be merged with merge_sketches.
+
+    :param df: the input dataframe.
+    :param keys: the columns to group by.
+    :param value: the column to sketch.
+    :param compression: the t-digest compression.
+    :return: a df of centroids, with the keys, mean and weight.
+    """
+    centroids = df[keys + [value]].dropna(subset=[value]).rename(columns={value: 'mean'})
+    centroids['weight'] = 1.0
+
+    return _compress(centroids, keys, compression)
+
+
+def merge_sketches(sketches: DataFrame, keys, compression=COMPRESSION):
+    """
+    Merge the sketches into one sketch per group of keys, e.g. merge monthly sketches of every account into one sketch
+    per month.
+
+    :param sketches: the centroids df from build_quantile_sketches, filtered to the selection.
+    :param keys: the columns to group by, a subset of the keys of the sketches.
+    :param compression: the t-digest compression.
+    :return: the merged centroids df.
+    """
+    return _compress(sketches[keys + ['mean', 'weight']], keys, compression)
+
+
+def get_quantiles(sketches: DataFrame, keys, quantiles=(0.25, 0.5, 0.75, 0.9)):
+    """
+    Get the estimated quantiles of each group of keys.
+
+    :param sketches: the centroids df from build_quantile_sketches, filtered to the selection.
+    :param keys: the columns to group by, a subset of the keys of the sketches.
+    :param quantiles: the quantiles to estimate.
+    :return: a df of the keys and a column per quantile, named p25, p50 etc.
+    """
+    merged = merge_sketches(sketches, keys)
+
+    def interpolate(centroids):
+        cum_weight = centroids['weight'].cumsum().to_numpy()
+        mid = (cum_weight - centroids['weight'].to_numpy() / 2) / cum_weight[-1]
+        return {f'p{round(q * 100)}': np.interp(q, mid, centroids['mean'].to_numpy()) for q in quantiles}
+
+    by = keys[0] if len(keys) == 1 else keys
+    rows = [{**dict(zip(keys, group if len(keys) > 1 else (group,))), **interpolate(centroids)}
+            for group, centroids in merged.groupby(by, observed=True, sort=True)]
+
+    quantile_df = DataFrame(rows, columns=keys + [f'p{round(q * 100)}' for q in quantiles])
+    # keep the order of categorical keys, e.g. the ARR brackets
+    return quantile_df.astype({key: merged[key].dtype for key in keys})
@@ -0,0 +1,97 @@
+"""
+Synthetic query results standing in for the warehouse, used by the load test and the tests.
+"""
+import os
+import sqlite3
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from data.queries import survey_summary_query_template
+
+# the day difference in SQLite, for building the survey summary from the synthetic survey rows
+SQLITE_DAYS_BETWEEN = 'CAST(julianday(purchase_day) - julianday(previous_day) AS INTEGER)'
+
+
+def get_months():
+    """
+    Get the months shown by the app, from 2022-01 to the last full month.
+    """
+    last_month = (datetime.now().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    return pd.date_range('2022-01-01', last_month, freq='MS').strftime('%Y-%m')
+
+
+def make_interaction_results(n_makers, n_accounts, rng):
+    """
+    :return: synthetic results of interaction_query, one row per maker and active month.
+    """
+    months = get_months()
+    account_arr = rng.choice([10000, 30000, 60000, 80000, 150000, 400000], n_accounts).astype(float)
+    maker_accounts = rng.integers(0, n_accounts, n_makers)
+
+    # each maker joins in a random month, then is active in ~70% of the following months
+    first_month = rng.integers(0, len(months), n_makers)
+    active = (np.arange(len(months)) >= first_month[:, None]) & (rng.random((n_makers, len(months))) < 0.7)
+    makers, month_idx = np.nonzero(active)
+    accounts = maker_accounts[makers]
+    n_rows = len(makers)
+
+    return pd.DataFrame({
+        'maker_id': makers,
+        'account_id': accounts,
+        'account_name': [f'Account {account}' for account in accounts],
+        'engaged_month': months[month_idx],
+        'engaged_days': rng.integers(1, 21, n_rows),
+        'total_engaged_time_in_m': rng.exponential(30, n_rows),
+        'num_unique_interactions': rng.integers(0, 50, n_rows),
+        'generic_active_maker': rng.random(n_rows) < 0.8,
+        'results_active_maker': rng.random(n_rows) < 0.5,
+        'total_account_arr': account_arr[accounts],
+    })
+
+
+def make_survey_results(n_makers, n_accounts, rng):
+    """
+    :return: synthetic results of survey_query, one row per maker and purchase day.
+    """
+    days = pd.date_range('2022-01-01', get_months()[-1], freq='D')
+    account_arr = rng.choice([10000, 30000, 60000, 80000, 150000, 400000], n_accounts).astype(float)
+    maker_accounts = rng.integers(0, n_accounts, n_makers)
+
+    makers = np.repeat(np.arange(n_makers), rng.integers(1, 8, n_makers))
+    df = pd.DataFrame({'maker_id': makers, 'day': days[rng.integers(0, len(days), len(makers))]})
+    df = df.drop_duplicates().sort_values(['maker_id', 'day'])
+
+    accounts = maker_accounts[df['maker_id']]
+    df['account_id'] = accounts
+    df['account_name'] = [f'Account {account}' for account in accounts]
+    df['purchase_month'] = df['day'].dt.strftime('%Y-%m')
+    df['num_days_survey'] = df.groupby(['maker_id', 'purchase_month'])['day'].transform('size')
+    df['monthly_total_survey'] = df['num_days_survey'] * rng.integers(1, 4, len(df))
+    df['purchase_day'] = df['day'].dt.strftime('%Y-%m-%d')
+    df['purchase_year'] = df['day'].dt.strftime('%Y')
+    df['total_account_arr'] = account_arr[accounts]
+
+    return df.drop(columns='day').reset_index(drop=True)
+
+
+def make_survey_summary_results(survey):
+    """
+    :return: the results of survey_summary_query on the synthetic survey rows, computed by SQLite.
+    """
+    query = survey_summary_query_template.format(survey_rows_ctes='survey_rows AS (SELECT * FROM survey_rows_table)',
+                                                 days_between=SQLITE_DAYS_BETWEEN)
+    connection = sqlite3.connect(':memory:')
+    survey.to_sql('survey_rows_table', connection, index=False)
+
+    return pd.read_sql_query(query, connection)
+
+
+def write_synthetic_results(path, n_makers, n_accounts, seed=0):
+    """
+    Write the synthetic results of each query as <path>/<query name>.parquet, which LocalWarehouse serves.
+    """
+    rng = np.random.default_rng(seed)
+    survey = make_survey_results(n_makers, n_accounts, rng)
+    make_interaction_results(n_makers, n_accounts, rng).to_parquet(os.path.join(path, 'interaction.parquet'))
+    survey.to_parquet(os.path.join(path, 'survey.parquet'))
+    make_survey_summary_results(survey).to_parquet(os.path.join(path, 'survey_summary.parquet'))
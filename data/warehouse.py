@@ -0,0 +1,160 @@
+import logging
+import os
+import queue
+import threading
+import time
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# number of warehouse connections open at most, i.e. the number of queries running at once across all sessions
+POOL_SIZE = 4
+# idle connections are checked before reuse if they have not been used for this many seconds
+HEALTH_CHECK_INTERVAL = 60
+HEALTH_CHECK_QUERY = 'SELECT 1'
+# a failed connection is reopened this many times, waiting BACKOFF_SECONDS * 2 ** attempt in between
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1
+
+
+class ConnectionPool:
+    """
+    A pool of warehouse connections shared by all the sessions of the app.
+
+    Connections are opened lazily with connect() up to size, and are reused most recently used first so the warm ones
+    stay warm. Callers wait for a free connection once size connections are in use, which bounds the number of
+    concurrent queries on the warehouse.
+    """
+
+    def __init__(self, connect, size=POOL_SIZE, health_check_interval=HEALTH_CHECK_INTERVAL, max_retries=MAX_RETRIES,
+                 backoff_seconds=BACKOFF_SECONDS):
+        self.connect = connect
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        # idle connections with the time they were last used
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _is_healthy(self, connection):
+        try:
+            connection.read_sql_query(HEALTH_CHECK_QUERY)
+            return True
+        except Exception:
+            logger.warning('Warehouse connection failed its health check', exc_info=True)
+            return False
+
+    def _discard(self, connection):
+        # not every client has a close method
+        close = getattr(connection, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                logger.debug('Closing a broken warehouse connection failed', exc_info=True)
+
+    def _open(self):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.connect()
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning('Connecting to the warehouse failed, retrying', exc_info=True)
+                time.sleep(self.backoff_seconds * 2 ** attempt)
+
+    def _acquire(self, check_health=False):
+        # after a connection broke the other idle ones are likely broken too, so they are all checked
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+
+            if not check_health and time.monotonic() - last_used <= self.health_check_interval:
+                return connection
+            if self._is_healthy(connection):
+                return connection
+            self._discard(connection)
+
+    def _release(self, connection):
+        self._idle.put((connection, time.monotonic()))
+
+    def _run(self, query, read):
+        """
+        Run the query on a pooled connection, waiting for one to be free if size connections are in use. If the
+        connection broke, the query is retried on a new connection with an exponential backoff. Errors of the query
+        itself are raised straight away.
+
+        :param query: the SQL query.
+        :param read: the function reading the query results from a connection, read(connection, query).
+        :return: the query results.
+        """
+        for attempt in range(self.max_retries + 1):
+            with self._slots:
+                connection = self._acquire(check_health=attempt > 0)
+                try:
+                    results = read(connection, query)
+                except Exception:
+                    # with a healthy connection the failure comes from the query, retrying would fail the same way
+                    if self._is_healthy(connection):
+                        self._release(connection)
+                        raise
+                    self._discard(connection)
+                    if attempt == self.max_retries:
+                        raise
+                else:
+                    self._release(connection)
+                    return results
+
+            logger.warning('Warehouse connection lost, retrying the query')
+            time.sleep(self.backoff_seconds * 2 ** attempt)
+
+    def read_sql_query(self, query):
+        """
+        :param query: the SQL query.
+        :return: the query results df.
+        """
+        return self._run(query, lambda connection, query_: connection.read_sql_query(query_))
+
+    def read_sql_arrow(self, query, transform=None):
+        """
+        :param query: the SQL query.
+        :param transform: (optional) the function deriving columns from a table of results, applied to each record
+        batch.
+        :return: the query results as an Arrow table, streamed as record batches when the client supports it.
+        """
+        from data.arrow_helper import read_sql_arrow
+
+        return self._run(query, lambda connection, query_: read_sql_arrow(connection, query_, transform))
+
+
+class LocalWarehouse:
+    """
+    A stand-in for the warehouse client which serves saved query results, to run and test the app without the
+    warehouse. The results of each query are read from <path>/<query name>.parquet.
+    """
+
+    def __init__(self, path, queries):
+        """
+        :param path: the directory of the parquet files.
+        :param queries: query name -> SQL query.
+        """
+        self.path = path
+        self.names = {query: name for name, query in queries.items()}
+
+    def _file(self, query):
+        return os.path.join(self.path, f'{self.names[query]}.parquet')
+
+    def read_sql_query(self, query):
+        if query == HEALTH_CHECK_QUERY:
+            return pd.DataFrame({'?column?': [1]})
+        return pd.read_parquet(self._file(query))
+
+    def read_sql_arrow(self, query):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(self._file(query))
+        return pa.RecordBatchReader.from_batches(parquet_file.schema_arrow, parquet_file.iter_batches())
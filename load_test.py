@@ -0,0 +1,254 @@
+"""
+Load test of app.py: simulated sessions change the date range and the selected account, and the rerun latency,
+throughput and memory of each worker are reported.
+
+The app is driven headlessly with Streamlit's AppTest, with the Streamlit version pinned in requirements.txt, on
+synthetic query results served by LocalWarehouse instead of the warehouse.
+
+A worker process stands for a pod: its sessions share its cached data and connection pool. AppTest swaps a process-wide
+runtime on each run, so a worker serves the reruns of its sessions one at a time, in the order they were issued. This
+is close to a pod whose reruns are CPU bound, since the script threads of a Streamlit server share the GIL. The latency
+of a rerun is measured from when its session issued the action, so it includes the wait behind the other sessions of
+the pod. Each session issues its next action --think-time seconds after its previous rerun finished.
+
+The default single worker gives the numbers of one pod serving --sessions users. --workers spreads the sessions over
+several pods, e.g. to check that the pods don't slow each other down on the same host.
+
+    python load_test.py --sessions 8 --reruns 20
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import traceback
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+from data.synthetic import write_synthetic_results
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+# Session actions: what a user changes before a rerun
+def change_date_range(at, rng):
+    start_box, end_box = at.sidebar.selectbox[0], at.sidebar.selectbox[1]
+    # the start options are months[:-1] and the end options months[1:], the end is kept after the start
+    start = rng.randrange(len(start_box.options))
+    end = rng.randrange(start, len(end_box.options))
+    start_box.select(start_box.options[start])
+    end_box.select(end_box.options[end])
+
+
+def change_account(at, rng):
+    account_box = at.selectbox(key='account_name_temp')
+    account_box.select(rng.choice(account_box.options))
+
+
+def clear_account(at, rng):
+    # the Clear Selection buttons are only shown with an account selected, they rerun the app with st.rerun
+    buttons = [button for button in at.button if button.label.strip() == 'Clear Selection']
+    if buttons:
+        buttons[0].click()
+    else:
+        change_account(at, rng)
+
+
+ACTIONS = {
+    'dates': change_date_range,
+    'account': change_account,
+    'clear': clear_account,
+}
+
+
+def run_worker(worker, n_sessions, n_reruns, actions, think_time, timeout, seed, barrier, results):
+    """
+    Run the sessions of a worker process, then put its latencies and memory in results, or its error if it failed.
+    """
+    try:
+        results.put(run_sessions(worker, n_sessions, n_reruns, actions, think_time, timeout, seed, barrier))
+    except Exception:
+        # the other workers would wait for this one forever
+        barrier.abort()
+        results.put({'worker': worker, 'failed': traceback.format_exc()})
+
+
+def run_sessions(worker, n_sessions, n_reruns, actions, think_time, timeout, seed, barrier):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed + worker)
+    sessions = [AppTest.from_file(APP_PATH, default_timeout=timeout) for _ in range(n_sessions)]
+
+    # the first run loads the data into the cache of the worker, it is reported apart from the reruns
+    start = time.perf_counter()
+    for at in sessions:
+        at.run()
+    cold_start = time.perf_counter() - start
+
+    barrier.wait()
+    latencies = []
+    run_times = []
+    errors = 0
+    started = time.time()
+    # every session issues its first action now, the worker serves the issued actions in order
+    issued = [time.perf_counter()] * n_sessions
+    remaining = [n_reruns] * n_sessions
+    while any(remaining):
+        session = min((i for i in range(n_sessions) if remaining[i]), key=lambda i: issued[i])
+        wait = issued[session] - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+
+        at = sessions[session]
+        ACTIONS[rng.choice(actions)](at, rng)
+        start = time.perf_counter()
+        at.run()
+        end = time.perf_counter()
+
+        latencies.append(end - issued[session])
+        run_times.append(end - start)
+        errors += len(at.exception) > 0
+        remaining[session] -= 1
+        issued[session] = end + think_time
+    finished = time.time()
+
+    return {
+        'worker': worker,
+        'sessions': n_sessions,
+        'latencies': latencies,
+        'run_times': run_times,
+        'errors': errors,
+        'started': started,
+        'finished': finished,
+        'cold_start_s': cold_start,
+        # ru_maxrss is in kB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def summarise_results(worker_results):
+    """
+    :return: the rerun latency percentiles and throughput of all the sessions, and the memory of each worker.
+    """
+    import streamlit
+
+    latencies = np.concatenate([result['latencies'] for result in worker_results]) * 1000
+    run_times = np.concatenate([result['run_times'] for result in worker_results]) * 1000
+    duration = (max(result['finished'] for result in worker_results)
+                - min(result['started'] for result in worker_results))
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+
+    return {
+        'streamlit': streamlit.__version__,
+        'sessions': sum(result['sessions'] for result in worker_results),
+        'workers': len(worker_results),
+        'reruns': len(latencies),
+        'errors': sum(result['errors'] for result in worker_results),
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'run_p50_ms': np.percentile(run_times, 50),
+        'reruns_per_s': len(latencies) / duration,
+        'worker_stats': [
+            {key: result[key] for key in ['worker', 'sessions', 'cold_start_s', 'peak_rss_mb']}
+            for result in sorted(worker_results, key=lambda result: result['worker'])
+        ],
+    }
+
+
+def get_pinned_streamlit():
+    with open(os.path.join(os.path.dirname(APP_PATH), 'requirements.txt')) as f:
+        for line in f:
+            if line.startswith('streamlit=='):
+                return line.strip().split('==')[1]
+
+
+def print_summary(summary):
+    pinned = get_pinned_streamlit()
+    print(f"streamlit {summary['streamlit']}" + ('' if summary['streamlit'] == pinned else
+                                                 f", NOT the version pinned for the app ({pinned})"))
+    print(f"{summary['sessions']} sessions on {summary['workers']} workers (pods), {summary['reruns']} reruns, "
+          f"{summary['errors']} with errors")
+    print(f"rerun latency from the action, including the wait behind other sessions: p50 {summary['p50_ms']:.0f} ms, "
+          f"p95 {summary['p95_ms']:.0f} ms, p99 {summary['p99_ms']:.0f} ms")
+    print(f"run time of a rerun alone: p50 {summary['run_p50_ms']:.0f} ms")
+    print(f"throughput {summary['reruns_per_s']:.2f} reruns/s")
+    print(pd.DataFrame(summary['worker_stats']).round(2).to_string(index=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=4, help='number of simulated sessions')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes, each one a pod')
+    parser.add_argument('--reruns', type=int, default=10, help='reruns per session')
+    parser.add_argument('--think-time', type=float, default=2, help='seconds between a rerun and the next action')
+    parser.add_argument('--actions', nargs='+', choices=list(ACTIONS), default=list(ACTIONS),
+                        help='what the sessions change before each rerun')
+    parser.add_argument('--makers', type=int, default=3000, help='number of synthetic makers')
+    parser.add_argument('--accounts', type=int, default=200, help='number of synthetic accounts')
+    parser.add_argument('--data', default=None, help='directory of query results to reuse instead of synthetic ones')
+    parser.add_argument('--timeout', type=float, default=300, help='timeout of a run in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='(optional) file to write the results to')
+    args = parser.parse_args()
+
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        sys.exit('The load test needs AppTest, install requirements.txt.')
+
+    if args.data is None:
+        # the synthetic results are deleted on exit
+        with tempfile.TemporaryDirectory(prefix='engagement_load_test_') as path:
+            write_synthetic_results(path, args.makers, args.accounts, args.seed)
+            summary = run_load_test(args, path)
+    else:
+        summary = run_load_test(args, args.data)
+
+    print_summary(summary)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+def run_load_test(args, data_path):
+    """
+    Run the sessions on the worker processes, with the query results in data_path.
+
+    :return: the summary of the results.
+    """
+    n_workers = min(args.workers, args.sessions)
+    # the workers load the query results from LocalWarehouse
+    os.environ['DWH_LOCAL_PATH'] = data_path
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    ctx = mp.get_context('spawn')
+    barrier = ctx.Barrier(n_workers)
+    results = ctx.Queue()
+    workers = []
+    for worker in range(n_workers):
+        # sessions are spread evenly over the workers
+        n_sessions = args.sessions // n_workers + (worker < args.sessions % n_workers)
+        process = ctx.Process(target=run_worker, args=(worker, n_sessions, args.reruns, args.actions, args.think_time,
+                                                       args.timeout, args.seed, barrier, results))
+        process.start()
+        workers.append(process)
+
+    worker_results = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+
+    failed = [result for result in worker_results if 'failed' in result]
+    if failed:
+        # a worker aborted by another one's failure only reports a BrokenBarrierError
+        failed = [result for result in failed if 'BrokenBarrierError' not in result['failed']] or failed
+        sys.exit(f"Worker {failed[0]['worker']} failed:\n{failed[0]['failed']}")
+
+    return summarise_results(worker_results)
+
+
+if __name__ == '__main__':
+    main()
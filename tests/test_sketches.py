@@ -0,0 +1,43 @@
+"""
+The percentiles of a selected account, merged from its month sketches, must stay close to the exact quantiles. With the
+account sketches capped at 10 centroids, p50 was up to 12% off and p90 up to 30% off on these accounts.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from data.sketches import build_quantile_sketches, get_quantiles, ENGAGED_TIME_SKETCH_KEYS
+
+N_ACCOUNTS = 30
+MONTHS = ['2023-01', '2023-02', '2023-03', '2023-04', '2023-05', '2023-06']
+
+
+@pytest.fixture(scope='module')
+def engaged_time():
+    rng = np.random.default_rng(0)
+    frames = []
+    for account_code in range(N_ACCOUNTS):
+        sigma = rng.uniform(0.5, 1.5)
+        for month in MONTHS:
+            n_rows = rng.integers(200, 3000)
+            frames.append(pd.DataFrame({
+                'engaged_month': month,
+                'half_year_period': 'H1 2023',
+                'account_code': account_code,
+                'total_engaged_time_in_m': rng.lognormal(3, sigma, n_rows),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.mark.parametrize('quantile', [0.5, 0.9])
+def test_account_percentiles_match_exact_quantiles(engaged_time, quantile):
+    sketches = build_quantile_sketches(engaged_time, ENGAGED_TIME_SKETCH_KEYS, 'total_engaged_time_in_m')
+    column = f'p{round(quantile * 100)}'
+
+    for account_code in range(N_ACCOUNTS):
+        rows = engaged_time[engaged_time['account_code'] == account_code]
+        estimated = get_quantiles(sketches[sketches['account_code'] == account_code], ['engaged_month'],
+                                  quantiles=(quantile,)).set_index('engaged_month')[column]
+        exact = rows.groupby('engaged_month')['total_engaged_time_in_m'].agg(lambda times: np.quantile(times, quantile))
+
+        assert (rows.groupby('engaged_month').size() > 100).all()
+        np.testing.assert_allclose(estimated.loc[exact.index], exact, rtol=0.05)
@@ -0,0 +1,67 @@
+"""
+The survey frequency charts from survey_summary_query (SURVEY_QUERY_MODE=summary) must match the charts from the
+maker-day survey rows. The summary query is run on SQLite as the stand-in warehouse.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+from data.helper_functions import split_account_dimension, half_year, ARR_BIN_EDGES
+from data.pipeline import evaluate_nodes
+from data.synthetic import make_survey_results, make_survey_summary_results
+
+N_MAKERS = 400
+N_ACCOUNTS = 40
+
+DATE_RANGES = [
+    ('2022-01', '2023-12'),
+    ('2022-03', '2022-10'),
+    ('2022-11', '2023-02'),
+    ('2023-06', '2023-06'),
+]
+
+
+@pytest.fixture(scope='module')
+def survey_rows():
+    rng = np.random.default_rng(0)
+    survey = make_survey_results(N_MAKERS, N_ACCOUNTS, rng)
+
+    # every 5th maker made their later purchases from another account
+    accounts = survey.drop_duplicates('account_id').set_index('account_id')[['account_name', 'total_account_arr']]
+    moved = (survey['maker_id'] % 5 == 0) & (survey.groupby('maker_id').cumcount() % 2 == 1)
+    new_account_ids = accounts.index.to_numpy()[
+        (np.searchsorted(accounts.index.to_numpy(), survey.loc[moved, 'account_id']) + 1) % len(accounts)]
+    survey.loc[moved, 'account_id'] = new_account_ids
+    survey.loc[moved, ['account_name', 'total_account_arr']] = accounts.loc[new_account_ids].to_numpy()
+
+    return survey
+
+
+@pytest.fixture(scope='module')
+def inputs(survey_rows):
+    # the same steps as get_data_for_survey_frequency_metrics and get_data_for_survey_frequency_summary
+    df = survey_rows.copy()
+    df['purchase_day'] = pd.to_datetime(df['purchase_day'])
+    df, accounts = split_account_dimension(df)
+    df['half_year_period'] = df['purchase_month'].apply(half_year)
+    survey_data = (df, accounts)
+
+    survey_summary = split_account_dimension(make_survey_summary_results(survey_rows))
+
+    return {'survey_data': lambda: survey_data, 'survey_summary': lambda: survey_summary}
+
+
+def test_makers_in_two_accounts(survey_rows):
+    assert (survey_rows.groupby('maker_id')['account_id'].nunique() > 1).sum() > 0
+
+
+@pytest.mark.parametrize('start_month, end_month', DATE_RANGES)
+def test_summary_charts_match_survey_rows(inputs, start_month, end_month):
+    params = dict(start_month=start_month, end_month=end_month, arr_bin_edges=ARR_BIN_EDGES)
+    results = evaluate_nodes(['purchasers', 'chart6', 'chart7', 'summary_purchasers', 'summary_chart6',
+                              'summary_chart7'], params, inputs, {})
+
+    assert_frame_equal(results['summary_chart6']['table6'], results['chart6']['table6'])
+    assert_frame_equal(results['summary_chart7']['table7'], results['chart7']['table7'])
+    assert_frame_equal(results['summary_purchasers']['purchasers'], results['purchasers']['purchasers'],
+                       check_dtype=False)